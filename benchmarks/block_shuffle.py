@@ -0,0 +1,45 @@
+"""Compares block shuffling with a full permutation.
+
+For each mode, prints the time to generate one epoch of indices and the average number of distinct
+compressed chunks each batch reads from. Fewer chunks per batch means less decompression and more
+sequential image reads.
+
+    $ python benchmarks/block_shuffle.py --rows 1000000 --chunklen 4096 --batch-size 256
+"""
+import argparse
+import time
+
+import numpy as np
+
+from brine.sampler import block_permutation
+
+
+def chunks_per_batch(indices, chunklen, batch_size):
+    chunks = indices // chunklen
+    counts = [np.unique(chunks[start:start + batch_size]).size for start in range(0, indices.size, batch_size)]
+    return np.mean(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--chunklen', type=int, default=4096)
+    parser.add_argument('--batch-size', type=int, default=256)
+    args = parser.parse_args()
+
+    random_state = np.random.RandomState(0)
+    modes = [('full permutation', lambda: random_state.permutation(args.rows))]
+    for buffer_blocks in (1, 2, 4, 8, 16):
+        modes.append(('block shuffle, buffer_blocks=%d' % buffer_blocks,
+                      lambda b=buffer_blocks: block_permutation(args.rows, args.chunklen, b, random_state)))
+
+    for name, permutation in modes:
+        start = time.time()
+        indices = permutation()
+        elapsed = time.time() - start
+        print('%-36s %8.3fs %10.1f chunks/batch' % (
+            name, elapsed, chunks_per_batch(indices, args.chunklen, args.batch_size)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Measures how long importing brine and its command line tool takes, and which heavy modules they load.
+
+For each case, runs a fresh interpreter several times, prints the median wall time and lists the heavy
+dependencies (numpy, pandas, bcolz, PIL, ...) that ended up imported. Exits with status 1 if a case that
+should stay lightweight imports one of them, so it can be used as a regression check.
+
+    $ python benchmarks/import_time.py --repeat 10
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ['numpy', 'pandas', 'bcolz', 'PIL', 'tqdm', 'requests', 'keras', 'torch']
+
+# (name, code to run, whether the case must not import any heavy module)
+CASES = [
+    ('python', 'pass', True),
+    ('import brine', 'import brine', True),
+    ('import brine.__main__', 'import brine.__main__', True),
+    ('brine list', 'import brine.__main__; from brine.ls import ls', True),
+    ('import brine.dataset', 'import brine.dataset', False),
+    ('import brine.build', 'import brine.build', False),
+]
+
+REPORT = "import sys; print(' '.join(m for m in %r if m in sys.modules))" % (HEAVY_MODULES,)
+
+
+def run(code):
+    start = time.time()
+    output = subprocess.check_output([sys.executable, '-c', '%s\n%s' % (code, REPORT)], stderr=subprocess.DEVNULL,
+                                     universal_newlines=True)
+    return time.time() - start, output.split()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    regressions = []
+    for name, code, lightweight in CASES:
+        try:
+            timings = [run(code) for _ in range(args.repeat)]
+        except subprocess.CalledProcessError:
+            print('%-24s failed' % name)
+            continue
+        elapsed = sorted(timing for timing, _ in timings)[len(timings) // 2]
+        modules = timings[0][1]
+        print('%-24s %8.1fms   %s' % (name, elapsed * 1000, ' '.join(modules) or '-'))
+        if lightweight and modules:
+            regressions.append(name)
+
+    if regressions:
+        print('Heavy modules imported by: %s' % ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,25 @@
-from brine.dataset import load_dataset
+# Only the lightweight parts of brine are imported with the package, so that the command line tool starts fast.
+# The scientific stack (numpy, bcolz, PIL) is imported when a dataset is loaded.
+
+
+def load_dataset(dataset_name, base_path=None, columns=None, image_cache_size=None):
+    """Load a brine dataset that has been installed with `brine install`.
+
+    Parameters
+    ----------
+    dataset_name : str
+        The full name of the dataset to load (eg. examples/cifar10)
+    base_path : str
+        The path where the dataset was installed. If None, defaults to the current working directory.
+    columns : list of str
+        The names of the columns to load. Only these columns will be read from disk.
+        If None, all the columns are loaded. Defaults to None.
+    image_cache_size : int
+        If set, decoded images are kept in an in-memory LRU cache of at most this many bytes, so
+        that images read again in later epochs aren't decoded again. Defaults to None (no cache).
+    Returns
+    -------
+    :class:`~brine.dataset.Dataset`
+    """
+    from brine.dataset import load_dataset as _load_dataset
+    return _load_dataset(dataset_name, base_path=base_path, columns=columns, image_cache_size=image_cache_size)
@@ -1,20 +1,60 @@
 import argparse
 import sys
 
-from brine.install import install
-from brine.uninstall import uninstall
-from brine.ls import ls
-from brine.info import info
-from brine.build import build_config, build_data_dir
-from brine.push import push
 from brine.exceptions import BrineError
 
+# Commands import their modules when they run, so that eg. `brine list` doesn't load pandas and bcolz.
+
+
+def install_func(args):
+    from brine.install import install
+    install(args.dataset)
+
+
+def uninstall_func(args):
+    from brine.uninstall import uninstall
+    uninstall(args.dataset)
+
+
+def ls_func(args):
+    from brine.ls import ls
+    ls()
+
+
+def info_func(args):
+    from brine.info import info
+    info(args.dataset)
+
+
+def push_func(args):
+    from brine.push import push
+    push(args.dataset)
+
 
 def build_func(args):
-    if args.config is not None:
-        build_config(args.dataset, args.config)
+    from brine.build import append_config, build_config, build_data_dir
+    if args.append:
+        if args.config is None:
+            raise BrineError('--append requires --config.')
+        if args.decode_images:
+            raise BrineError('--append cannot be used with --decode-images. Images are decoded when the dataset '
+                             'already has decoded images.')
+        append_config(args.dataset, args.config, image_size=args.image_size, workers=args.workers, link=args.link,
+                      chunksize=args.chunksize)
+    elif args.config is not None:
+        build_config(args.dataset, args.config, decode_images=args.decode_images, image_size=args.image_size,
+                     workers=args.workers, link=args.link, chunksize=args.chunksize)
     elif args.data_dir is not None:
-        build_data_dir(args.dataset, args.data_dir)
+        build_data_dir(args.dataset, args.data_dir, decode_images=args.decode_images, image_size=args.image_size,
+                       workers=args.workers, link=args.link, chunksize=args.chunksize)
+
+
+def image_size(value):
+    try:
+        width, height = value.lower().split('x')
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Image size %s is not valid. Expected <width>x<height>.' % value)
 
 
 def main():
@@ -28,7 +68,7 @@ def main():
         'dataset',
         metavar='<dataset>',
         type=str)
-    install_parser.set_defaults(func=lambda args: install(args.dataset))
+    install_parser.set_defaults(func=install_func)
 
     # brine uninstall <dataset>
     uninstall_parser = subparsers.add_parser('uninstall')
@@ -36,11 +76,11 @@ def main():
         'dataset',
         metavar='<dataset>',
         type=str)
-    uninstall_parser.set_defaults(func=lambda args: uninstall(args.dataset))
+    uninstall_parser.set_defaults(func=uninstall_func)
 
     # brine list
     ls_parser = subparsers.add_parser('list')
-    ls_parser.set_defaults(func=lambda args: ls())
+    ls_parser.set_defaults(func=ls_func)
 
     # brine info <dataset>
     info_parser = subparsers.add_parser('info')
@@ -48,9 +88,11 @@ def main():
         'dataset',
         metavar='<dataset>',
         type=str)
-    info_parser.set_defaults(func=lambda args: info(args.dataset))
+    info_parser.set_defaults(func=info_func)
 
-    # brine build <dataset> (--config=<config file> --data-dir<data directory>)
+    # brine build <dataset> (--config=<config file> --data-dir<data directory>) [--decode-images]
+    #             [--image-size=<width>x<height>] [--workers=<workers>] [--link=(copy|hardlink|reflink)]
+    #             [--chunksize=<rows>] [--append]
     build_parser = subparsers.add_parser('build')
     build_parser.add_argument(
         'dataset',
@@ -65,6 +107,28 @@ def main():
         '--data-dir',
         metavar='<data directory>',
         type=str)
+    build_parser.add_argument(
+        '--decode-images',
+        action='store_true')
+    build_parser.add_argument(
+        '--image-size',
+        metavar='<width>x<height>',
+        type=image_size)
+    build_parser.add_argument(
+        '--workers',
+        metavar='<workers>',
+        type=int)
+    build_parser.add_argument(
+        '--link',
+        choices=['copy', 'hardlink', 'reflink'],
+        default='copy')
+    build_parser.add_argument(
+        '--chunksize',
+        metavar='<rows>',
+        type=int)
+    build_parser.add_argument(
+        '--append',
+        action='store_true')
     build_parser.set_defaults(func=build_func)
 
     # brine push <dataset>
@@ -73,7 +137,7 @@ def main():
         'dataset',
         metavar='<dataset>',
         type=str)
-    push_parser.set_defaults(func=lambda args: push(args.dataset))
+    push_parser.set_defaults(func=push_func)
 
     args = parser.parse_args()
 
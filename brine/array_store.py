@@ -0,0 +1,135 @@
+import os
+import numpy as np
+
+from brine.exceptions import BrineError
+
+
+ARRAYS_DIR_NAME = 'arrays'
+
+
+class ArrayStoreWriter(object):
+    """Writes the decoded images of an Image column to a packed uint8 file.
+
+    Each image is appended as a (height, width, channels) uint8 array. An index with one
+    (offset, height, width, channels) entry per row is saved next to the data file when the writer is closed.
+    If append is True, images are added after the ones already in the store, and :meth:`discard` removes them.
+    """
+
+    def __init__(self, dataset_path, column_name, append=False):
+        dir_path = os.path.join(dataset_path, ARRAYS_DIR_NAME)
+        try:
+            os.makedirs(dir_path)
+        except OSError:
+            if not os.path.isdir(dir_path):
+                raise ArrayStoreError('Could not create directory %s.' % dir_path)
+        self.data_path, self.index_path = _store_paths(dataset_path, column_name)
+        if append:
+            try:
+                self.index = [tuple(entry) for entry in np.load(self.index_path).tolist()]
+                self.data_file = open(self.data_path, 'r+b')
+            except (IOError, ValueError):
+                raise ArrayStoreError('Could not open array store %s.' % self.data_path)
+            self.offset = sum(height * width * channels for _, height, width, channels in self.index)
+            # Drops any bytes left after the indexed images by an interrupted append
+            self.data_file.truncate(self.offset)
+            self.data_file.seek(self.offset)
+        else:
+            self.data_file = open(self.data_path, 'wb')
+            self.offset = 0
+            self.index = []
+        self.start_offset = self.offset
+
+    def append(self, array):
+        array = np.ascontiguousarray(array, dtype=np.uint8)
+        if array.ndim == 2:
+            array = array[:, :, np.newaxis]
+        if array.ndim != 3:
+            raise ArrayStoreError('Could not store array with shape %s.' % (array.shape,))
+        self.data_file.write(array.tobytes())
+        self.index.append((self.offset,) + array.shape)
+        self.offset += array.size
+
+    def close(self):
+        self.data_file.close()
+        # The index is replaced in one rename. Readers only map the bytes of the images in the index they loaded, so
+        # they see either all the new images or none of them
+        temp_index_path = self.index_path + '.tmp'
+        with open(temp_index_path, 'wb') as f:
+            np.save(f, np.array(self.index, dtype=np.int64).reshape(-1, 4))
+        os.replace(temp_index_path, self.index_path)
+
+    def discard(self):
+        """Closes the writer without saving the images appended since it was opened."""
+        self.data_file.truncate(self.start_offset)
+        self.data_file.close()
+
+
+class ArrayStore(object):
+    """Reads the decoded images of an Image column from a packed uint8 file written by ArrayStoreWriter.
+
+    The data file is memory-mapped, so rows are returned as zero-copy views and reading them only costs
+    page cache or disk reads.
+    """
+
+    def __init__(self, dataset_path, column_name):
+        self.data_path, self.index_path = _store_paths(dataset_path, column_name)
+        self.index = np.load(self.index_path)
+        num_bytes = int((self.index[:, 0] + self.index[:, 1:].prod(axis=1)).max()) if self.index.shape[0] else 0
+        if num_bytes:
+            # An append in progress, or one that was interrupted, can leave bytes after the indexed images
+            self.data = np.memmap(self.data_path, dtype=np.uint8, mode='r', shape=(num_bytes,))
+        else:
+            self.data = np.zeros(0, dtype=np.uint8)
+        shapes = self.index[:, 1:]
+        if shapes.shape[0] and (shapes == shapes[0]).all():
+            self.shape = tuple(int(size) for size in shapes[0])
+        else:
+            self.shape = None
+
+    @staticmethod
+    def exists(dataset_path, column_name):
+        data_path, index_path = _store_paths(dataset_path, column_name)
+        return os.path.isfile(data_path) and os.path.isfile(index_path)
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    def __getitem__(self, index):
+        offset, height, width, channels = self.index[index]
+        return self.data[offset:offset + height * width * channels].reshape(height, width, channels)
+
+    def get_batch(self, indices):
+        """Returns the arrays for several rows stacked in a single (len(indices), height, width, channels) array.
+
+        All the rows must have the same shape.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if self.shape is None:
+            try:
+                return np.stack([self[index] for index in indices])
+            except ValueError:
+                raise ArrayStoreError('Could not stack arrays with different shapes. Use a fixed image size.')
+        return self.data.reshape((-1,) + self.shape)[indices]
+
+
+class ArrayStoreError(BrineError):
+    pass
+
+
+def decode_image(path, size=None, mode='RGB'):
+    """Decodes an image file to a uint8 numpy array, converting it to `mode` and resizing it to `size` if set."""
+    from PIL import Image
+    try:
+        image = Image.open(path)
+        if mode is not None and image.mode != mode:
+            image = image.convert(mode)
+        if size is not None and image.size != tuple(size):
+            image = image.resize(tuple(size), Image.BILINEAR)
+        return np.asarray(image, dtype=np.uint8)
+    except IOError:
+        raise ArrayStoreError('Could not decode image file %s.' % path)
+
+
+def _store_paths(dataset_path, column_name):
+    dir_path = os.path.join(dataset_path, ARRAYS_DIR_NAME)
+    return os.path.join(dir_path, column_name + '.bin'), os.path.join(dir_path, column_name + '.index.npy')
@@ -8,19 +8,39 @@ from brine.util import TemporaryDirectory, is_image_file
 from brine.exceptions import BrineError
 
 
-def build_config(dataset_name, config_file_path):
+def build_config(dataset_name, config_file_path, decode_images=False, image_size=None, workers=None, link='copy',
+                 chunksize=None):
     dataset_manager = DatasetManager.get_from_dir(dataset_name, os.getcwd())
     dataset_manager.check_can_install()
 
-    builder = Builder()
-    with TemporaryDirectory() as temp_dir_path:
+    builder = Builder(decode_images=decode_images, image_size=image_size, workers=workers, link=link,
+                      chunksize=chunksize)
+    # Build next to the installed dataset, so that moving it in place is a rename and images can be linked
+    # from the same filesystem
+    parent_dir_path = os.path.dirname(dataset_manager.path)
+    try:
+        os.makedirs(parent_dir_path, exist_ok=True)
+    except OSError:
+        raise BrineError('Could not create directory %s.' % parent_dir_path)
+    with TemporaryDirectory(dir=parent_dir_path) as temp_dir_path:
         builder.build_from_config(config_file_path, temp_dir_path)
         dataset_manager.create_from_dir(temp_dir_path)
 
     print('Dataset %s was built.' % dataset_name)
 
 
-def build_data_dir(dataset_name, data_dir_path):
+def append_config(dataset_name, config_file_path, image_size=None, workers=None, link='copy', chunksize=None):
+    dataset_manager = DatasetManager.get_from_dir(dataset_name, os.getcwd())
+    dataset_manager.check_can_append()
+
+    builder = Builder(image_size=image_size, workers=workers, link=link, chunksize=chunksize)
+    builder.append_from_config(config_file_path, dataset_manager.path)
+
+    print('Rows were appended to dataset %s.' % dataset_name)
+
+
+def build_data_dir(dataset_name, data_dir_path, decode_images=False, image_size=None, workers=None, link='copy',
+                   chunksize=None):
     file_paths = glob.glob(os.path.join(data_dir_path, '**', '*.*'), recursive=True)
 
     image_paths = list(filter(is_image_file, file_paths))
@@ -50,4 +70,5 @@ def build_data_dir(dataset_name, data_dir_path):
     except IOError:
         raise BrineError('Could not create csv file %s.' % csv_file_path)
 
-    build_config(dataset_name, config_file_path)
+    build_config(dataset_name, config_file_path, decode_images=decode_images, image_size=image_size, workers=workers,
+                 link=link, chunksize=chunksize)
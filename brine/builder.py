@@ -3,31 +3,238 @@ import errno
 import shutil
 import os
 import json
+import sys
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import bcolz
 import pandas
 import numpy as np
 
 from brine.exceptions import BrineError
+from brine.array_store import ArrayStore, ArrayStoreWriter, decode_image
+from brine.category_index import CategoryIndex
 from brine.schema import Schema, Integer, Float, Category, String, Image, IntegerArray, FloatArray, CategoryArray
 
 
+# Copying images is mostly waiting on storage, so more threads than cores help, especially on network storage
+DEFAULT_COPY_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+LINK_MODES = ('copy', 'hardlink', 'reflink')
+
+# dtypes of the bcolz columns written by streaming builds. String and Image columns are sized from the csv file.
+STREAM_DTYPES = {
+    'integer': np.int64,
+    'float': np.float64,
+    'category': np.int64,
+    'integer_array': object,
+    'float_array': object,
+    'category_array': object,
+}
+
+# The file where bcolz keeps the attributes of a table, such as the schema
+ATTRS_FILE_NAME = '__attrs__'
+
+# Suffixes of the column directories written while a column of the bcolz table is widened
+NEW_COLUMN_SUFFIX = '.new'
+OLD_COLUMN_SUFFIX = '.old'
+
+# PIL modes of decoded images by number of channels
+CHANNEL_MODES = {1: 'L', 3: 'RGB', 4: 'RGBA'}
+
+# ioctl that clones a file on filesystems with copy-on-write support (btrfs, xfs, ...), from linux/fs.h
+FICLONE = 0x40049409
+
+
 class Builder(object):
+    """Builds a brine dataset from a config file and a csv file.
+
+    Parameters
+    ----------
+    decode_images : bool
+        Whether to also decode every Image column into a packed uint8 array file, so that rows can be read
+        with :meth:`~brine.dataset.Dataset.load_array` without decoding images. Defaults to False.
+    image_size : tuple of int
+        The (width, height) to resize decoded images to. If None, images keep their size. Defaults to None.
+    image_mode : str
+        The PIL mode to convert decoded images to. Defaults to 'RGB'.
+    workers : int
+        The number of threads that copy and decode images. If None, defaults to 4 times the number of CPUs, up to 32.
+    link : str
+        How image files are added to the dataset: 'copy' copies them, 'hardlink' creates hard links to the source
+        files and 'reflink' creates copy-on-write clones of them, on Linux filesystems that support it (btrfs, xfs).
+        Links are only possible when the source files and the dataset are on the same filesystem; files are copied
+        otherwise. Hard links share their contents with the source files, so the source files must not be modified
+        afterwards. Defaults to 'copy'.
+    chunksize : int
+        If set, the csv file is read and written to the dataset chunksize rows at a time, and images are copied while
+        the next chunk is read, so that building uses a bounded amount of memory however large the csv file is.
+        If None, the whole csv file is loaded in memory. Defaults to None.
+    """
+
+    def __init__(self, decode_images=False, image_size=None, image_mode='RGB', workers=None, link='copy',
+                 chunksize=None):
+        if link not in LINK_MODES:
+            raise BuilderError('Unsupported link mode %s. Expected one of %s.' % (link, ', '.join(LINK_MODES)))
+        self.decode_images = decode_images
+        self.image_size = image_size
+        self.image_mode = image_mode
+        self.workers = workers or DEFAULT_COPY_WORKERS
+        self.link = link
+        self.chunksize = chunksize
+        # Set when linking fails because the filesystem doesn't support it, to copy the next files right away
+        self._link_unsupported = False
 
     def build_from_config(self, config_file_path, destination_dir_path):
+        config_columns, config_path, config_extra_data = self.read_config(config_file_path)
+        dtype, converters = self.column_converters(config_columns)
+        csv_file_path = os.path.join(os.path.dirname(config_file_path), config_path)
+        if self.chunksize:
+            self.stream_csv(config_columns, dtype, converters, csv_file_path, os.path.dirname(config_file_path),
+                            destination_dir_path, config_extra_data)
+            return
+
+        try:
+            df = pandas.read_csv(csv_file_path, dtype=dtype, converters=converters)
+        except IOError:
+            raise BuilderError('Could not read csv file %s.' % csv_file_path)
+        df = df.reindex(columns=[config_column['name'] for config_column in config_columns])
+        image_column_names = [config_column['name'] for config_column in config_columns
+                              if config_column['type'] == 'image']
+        num_image_passes = 2 if self.decode_images else 1
+        progress_bar = tqdm(unit=' images', total=num_image_passes * len(image_column_names) * df.shape[0])
+
+        schema = self.build_schema(config_columns, converters)
+        for name in image_column_names:
+            self.copy_image_files(df[name], os.path.dirname(config_file_path), destination_dir_path, progress_bar)
+            if self.decode_images:
+                self.decode_image_files(df[name], name, destination_dir_path, progress_bar)
+
+        ctable = bcolz.ctable.fromdataframe(df, rootdir=os.path.join(destination_dir_path, 'bcolz'))
+        ctable.attrs['extra_data'] = json.dumps(config_extra_data)
+        ctable.attrs['schema'] = json.dumps(schema.to_obj())
+        ctable.flush()
+        self.write_category_indices(schema, df, destination_dir_path)
+
+    def append_from_config(self, config_file_path, dataset_dir_path):
+        """Appends the rows of the csv file of a config to an existing dataset, without rebuilding it.
+
+        The config must have the same columns as the dataset. New categories are numbered after the existing ones, so
+        the codes of the existing rows don't change, and only the image files that aren't in the dataset yet are
+        copied. Decoded images are appended if the dataset has them, with the size and mode of the images already
+        decoded. The schema with the new categories is saved before the rows that use them are appended, and if
+        appending fails, the rows, decoded images and schema are rolled back. Category indices are rebuilt at the end.
+
+        String and Image columns are widened beforehand if the new values are longer than the fixed width of their
+        bcolz column. A widened column is written next to the old one and swapped in by renaming, and it is kept if
+        appending fails.
+        """
+        config_columns, config_path, _ = self.read_config(config_file_path)
+        rootdir = os.path.join(dataset_dir_path, 'bcolz')
+        restore_columns(rootdir)
+        try:
+            ctable = bcolz.open(rootdir, mode='a')
+            old_schema = ctable.attrs['schema']
+            schema = Schema.from_obj(json.loads(old_schema))
+        except (IOError, KeyError, ValueError):
+            raise BuilderError('Could not open dataset at %s.' % dataset_dir_path)
+        if [(config_column['name'], config_column['type']) for config_column in config_columns] != \
+                [(column.name, column.to_obj()['type']) for column in schema.columns]:
+            raise BuilderError('The columns of config file %s do not match the columns of the dataset.' %
+                               config_file_path)
+
+        dtype, converters = self.column_converters(config_columns, schema)
+        names = [config_column['name'] for config_column in config_columns]
+        column_types = {config_column['name']: config_column['type'] for config_column in config_columns}
+        image_column_names = [name for name in names if column_types[name] == 'image']
+        src_dir_path = os.path.dirname(config_file_path)
+        csv_file_path = os.path.join(src_dir_path, config_path)
+        num_rows, widths = self.scan_csv(csv_file_path, [name for name in names
+                                                         if column_types[name] in ('string', 'image')])
+        decode_options = {name: self.append_decode_options(dataset_dir_path, name) for name in image_column_names
+                          if ArrayStore.exists(dataset_dir_path, name)}
+        if any([widen_column(rootdir, ctable, name, width) for name, width in widths.items()]):
+            # The table still has the old columns open
+            ctable = bcolz.open(rootdir, mode='a')
+        progress_bar = tqdm(unit=' images', total=(len(image_column_names) + len(decode_options)) * num_rows)
 
+        num_old_rows = len(ctable)
+        array_writers = {}
+        created_dir_paths = set()
+        new_file_paths = []
+        try:
+            for name in decode_options:
+                array_writers[name] = ArrayStoreWriter(dataset_dir_path, name, append=True)
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for chunk in self.read_csv_chunks(csv_file_path, dtype, converters):
+                    chunk = chunk.reindex(columns=names)
+                    columns = [column_array(chunk[name].values, ctable.cols[name].dtype) for name in names]
+                    # Saved before the rows that use the new categories, in a single write
+                    chunk_schema = json.dumps(self.build_schema(config_columns, converters).to_obj())
+                    if chunk_schema != ctable.attrs['schema']:
+                        ctable = replace_attr(rootdir, ctable, 'schema', chunk_schema)
+                    ctable.append(columns)
+
+                    image_paths = {name: chunk[name].tolist() for name in image_column_names}
+                    pairs = [pair for name in image_column_names
+                             for pair in self.prepare_copies(image_paths[name], src_dir_path, dataset_dir_path,
+                                                             created_dir_paths, skip_existing=True)]
+                    new_file_paths.extend(dst_file_path for _, dst_file_path in pairs)
+                    futures = [executor.submit(self.add_file, *pair) for pair in pairs]
+                    self.finish_chunk((image_paths, futures), executor, array_writers, dataset_dir_path,
+                                      progress_bar, decode_options)
+            ctable.flush()
+        except BaseException:
+            ctable.resize(num_old_rows)
+            replace_attr(rootdir, ctable, 'schema', old_schema)
+            for writer in array_writers.values():
+                writer.discard()
+            for file_path in new_file_paths:
+                remove_file(file_path)
+            raise
+        for writer in array_writers.values():
+            writer.close()
+        self.write_chunked_category_indices(Schema.from_obj(json.loads(ctable.attrs['schema'])), ctable,
+                                            dataset_dir_path)
+
+    def append_decode_options(self, dataset_dir_path, column_name):
+        """Returns the (size, mode) to decode the appended images of a column to, so that they match the images
+        already in its array store.
+        """
+        store = ArrayStore(dataset_dir_path, column_name)
+        if len(store) == 0:
+            return self.image_size, self.image_mode
+        if store.shape is None:
+            if self.image_size is not None:
+                raise BuilderError('The decoded images of column %s have different sizes and cannot be resized.' %
+                                   column_name)
+            return None, self.image_mode
+        height, width, channels = store.shape
+        if self.image_size is not None and tuple(self.image_size) != (width, height):
+            raise BuilderError('The decoded images of column %s have size %dx%d, not %dx%d.' %
+                               ((column_name, width, height) + tuple(self.image_size)))
+        if channels not in CHANNEL_MODES:
+            raise BuilderError('The decoded images of column %s have an unsupported number of channels %d.' %
+                               (column_name, channels))
+        return (width, height), CHANNEL_MODES[channels]
+
+    def read_config(self, config_file_path):
         try:
             with codecs.open(config_file_path, 'r', encoding='utf-8') as f:
                 config = json.loads(f.read())
-                config_columns = config['columns']
-                config_path = config['path']
-                config_extra_data = config.get('extra_data') or None
+                return config['columns'], config['path'], config.get('extra_data') or None
         except (IOError, ValueError, KeyError):
             raise BuilderError('Could not parse config file %s.' % config_file_path)
 
+    def column_converters(self, config_columns, schema=None):
+        """Returns the dtype and converters arguments of pandas.read_csv for the columns of a config.
+
+        If schema is set, the category converters start from the categories of its columns.
+        """
+        categories = {column.name: column.categories for column in schema.columns} if schema is not None else {}
         dtype = {}
         converters = {}
-        num_image_columns = 0
         for config_column in config_columns:
             name = config_column['name']
             column_type = config_column['type']
@@ -36,13 +243,12 @@ class Builder(object):
             elif column_type == 'float':
                 dtype[name] = np.float
             elif column_type == 'category':
-                converter = CategoryConverter()
+                converter = CategoryConverter(categories.get(name))
                 converters[name] = converter
             elif column_type == 'string':
                 dtype[name] = np.unicode
             elif column_type == 'image':
                 dtype[name] = np.unicode
-                num_image_columns = num_image_columns + 1
             elif column_type == 'integer_array':
                 converter = ArrayConverter(np.int64)
                 converters[name] = converter
@@ -50,19 +256,13 @@ class Builder(object):
                 converter = ArrayConverter(np.float)
                 converters[name] = converter
             elif column_type == 'category_array':
-                converter = ArrayConverter(CategoryConverter())
+                converter = ArrayConverter(CategoryConverter(categories.get(name)))
                 converters[name] = converter
             else:
                 raise BuilderError('Unsupported column type for column %s.' % name)
+        return dtype, converters
 
-        csv_file_path = os.path.join(os.path.dirname(config_file_path), config_path)
-        try:
-            df = pandas.read_csv(csv_file_path, dtype=dtype, converters=converters)
-        except IOError:
-            raise BuilderError('Could not read csv file %s.' % csv_file_path)
-        df = df.reindex(columns=[config_column['name'] for config_column in config_columns])
-        progress_bar = tqdm(unit=' images', total=num_image_columns * df.shape[0])
-
+    def build_schema(self, config_columns, converters):
         schema = Schema()
         for config_column in config_columns:
             name = config_column['name']
@@ -77,9 +277,6 @@ class Builder(object):
                 schema.add_column(name, String())
             elif column_type == 'image':
                 schema.add_column(name, Image())
-                for file_path in df[name]:
-                    self.copy_image_file(file_path, os.path.dirname(config_file_path), destination_dir_path)
-                    progress_bar.update(1)
             elif column_type == 'integer_array':
                 schema.add_column(name, IntegerArray())
             elif column_type == 'float_array':
@@ -88,37 +285,330 @@ class Builder(object):
                 schema.add_column(name, CategoryArray(converters[name].items_converter.categories))
             else:
                 raise BuilderError('Unsupported column type for column %s.' % name)
+        return schema
 
-        ctable = bcolz.ctable.fromdataframe(df, rootdir=os.path.join(destination_dir_path, 'bcolz'))
+    def stream_csv(self, config_columns, dtype, converters, csv_file_path, src_dir_path, dst_dir_path,
+                   config_extra_data):
+        """Builds the dataset from the csv file chunksize rows at a time, so memory use doesn't grow with its size.
+
+        A first pass over the csv file counts the rows and finds the longest value of each String and Image column,
+        since bcolz stores strings with a fixed width. Each chunk is then converted and appended to the bcolz table,
+        while the images of the previous chunk are copied by the thread pool. Category codes are kept across chunks
+        by the converters.
+        """
+        names = [config_column['name'] for config_column in config_columns]
+        column_types = {config_column['name']: config_column['type'] for config_column in config_columns}
+        image_column_names = [name for name in names if column_types[name] == 'image']
+        num_rows, widths = self.scan_csv(csv_file_path, [name for name in names
+                                                         if column_types[name] in ('string', 'image')])
+        column_dtypes = {name: STREAM_DTYPES.get(column_types[name]) or 'U%d' % max(widths[name], 1)
+                         for name in names}
+        num_image_passes = 2 if self.decode_images else 1
+        progress_bar = tqdm(unit=' images', total=num_image_passes * len(image_column_names) * num_rows)
+
+        rootdir = os.path.join(dst_dir_path, 'bcolz')
+        ctable = None
+        array_writers = {}
+        pending = deque()
+        created_dir_paths = set()
+        try:
+            if self.decode_images:
+                for name in image_column_names:
+                    array_writers[name] = ArrayStoreWriter(dst_dir_path, name)
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for chunk in self.read_csv_chunks(csv_file_path, dtype, converters):
+                    chunk = chunk.reindex(columns=names)
+                    columns = [column_array(chunk[name].values, column_dtypes[name]) for name in names]
+                    if ctable is None:
+                        # Sizes the chunks for the whole table, like an in-memory build, not for the first chunk
+                        ctable = bcolz.ctable(columns=columns, names=names, rootdir=rootdir, mode='w',
+                                              expectedlen=num_rows)
+                    else:
+                        ctable.append(columns)
+
+                    image_paths = {name: chunk[name].tolist() for name in image_column_names}
+                    futures = [executor.submit(self.add_file, *pair)
+                               for name in image_column_names
+                               for pair in self.prepare_copies(image_paths[name], src_dir_path, dst_dir_path,
+                                                               created_dir_paths)]
+                    pending.append((image_paths, futures))
+                    # Copies of the previous chunk run while this one was parsed
+                    while len(pending) > 1:
+                        self.finish_chunk(pending.popleft(), executor, array_writers, dst_dir_path, progress_bar)
+                while pending:
+                    self.finish_chunk(pending.popleft(), executor, array_writers, dst_dir_path, progress_bar)
+        finally:
+            for writer in array_writers.values():
+                writer.close()
+
+        if ctable is None:
+            columns = [np.zeros(0, dtype=column_dtypes[name]) for name in names]
+            ctable = bcolz.ctable(columns=columns, names=names, rootdir=rootdir, mode='w')
+        schema = self.build_schema(config_columns, converters)
         ctable.attrs['extra_data'] = json.dumps(config_extra_data)
         ctable.attrs['schema'] = json.dumps(schema.to_obj())
         ctable.flush()
+        self.write_chunked_category_indices(schema, ctable, dst_dir_path)
+
+    def scan_csv(self, csv_file_path, string_column_names):
+        num_rows = 0
+        widths = {name: 0 for name in string_column_names}
+        for chunk in self.read_csv_chunks(csv_file_path, str, None, usecols=string_column_names or [0]):
+            num_rows += chunk.shape[0]
+            for name in string_column_names:
+                if chunk.shape[0]:
+                    widths[name] = max(widths[name], int(chunk[name].astype(str).str.len().max()))
+        return num_rows, widths
+
+    def read_csv_chunks(self, csv_file_path, dtype, converters, usecols=None):
+        try:
+            reader = pandas.read_csv(csv_file_path, dtype=dtype, converters=converters, usecols=usecols,
+                                     chunksize=self.chunksize)
+            if self.chunksize is None:
+                # The whole file is a single chunk
+                yield reader
+                return
+            for chunk in reader:
+                yield chunk
+        except IOError:
+            raise BuilderError('Could not read csv file %s.' % csv_file_path)
+
+    def finish_chunk(self, item, executor, array_writers, dst_dir_path, progress_bar, decode_options=None):
+        image_paths, futures = item
+        for future in futures:
+            future.result()
+        for name, file_paths in image_paths.items():
+            progress_bar.update(len(file_paths))
+            writer = array_writers.get(name)
+            if writer is not None:
+                options = [(decode_options or {}).get(name)] * len(file_paths)
+                for array in executor.map(self.decode_file, file_paths, [dst_dir_path] * len(file_paths), options):
+                    writer.append(array)
+                    progress_bar.update(1)
+
+    def write_chunked_category_indices(self, schema, ctable, dst_dir_path):
+        for column in schema.columns:
+            if column.categories is not None:
+                carray = ctable.cols[column.name]
+                chunksize = self.chunksize or max(len(carray), 1)
 
-    def copy_image_file(self, file_path, src_dir_path, dst_dir_path):
+                def read_chunks(carray=carray, chunksize=chunksize):
+                    return (carray[start:start + chunksize] for start in range(0, len(carray), chunksize))
+
+                index = CategoryIndex.from_chunks(read_chunks, len(column.categories), multi_valued=column.isarray())
+                index.save(dst_dir_path, column.name)
+
+    def copy_image_files(self, file_paths, src_dir_path, dst_dir_path, progress_bar):
+        """Copies (or links) the image files of a column into the dataset with a pool of threads.
+
+        The destination directories are created up front, and files listed several times are only copied once.
+        """
+        file_paths = list(file_paths)
+        pairs = self.prepare_copies(file_paths, src_dir_path, dst_dir_path, set())
+        progress_bar.update(len(file_paths) - len(pairs))
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for _ in executor.map(lambda pair: self.add_file(*pair), pairs):
+                progress_bar.update(1)
+
+    def prepare_copies(self, file_paths, src_dir_path, dst_dir_path, created_dir_paths, skip_existing=False):
+        """Returns the (source, destination) paths of the distinct files, after creating their destination
+        directories. Directories in created_dir_paths are skipped, and the new ones are added to it.
+        If skip_existing is True, files that are already in the dataset are left out.
+        """
+        pairs = [self.image_file_paths(file_path, src_dir_path, dst_dir_path)
+                 for file_path in OrderedDict.fromkeys(file_paths)]
+        if skip_existing:
+            pairs = [(src_file_path, dst_file_path) for src_file_path, dst_file_path in pairs
+                     if not os.path.exists(dst_file_path)]
+        for dir_path in sorted(set(os.path.dirname(dst_file_path) for _, dst_file_path in pairs) - created_dir_paths):
+            try:
+                os.makedirs(dir_path, exist_ok=True)
+            except OSError:
+                raise BuilderError('Could not create directory %s.' % dir_path)
+            created_dir_paths.add(dir_path)
+        return pairs
+
+    def image_file_paths(self, file_path, src_dir_path, dst_dir_path):
         src_file_path = os.path.join(src_dir_path, file_path)
         dst_file_path = os.path.join(dst_dir_path, 'images', file_path)
         if not os.path.abspath(dst_file_path).startswith(dst_dir_path):
             raise BuilderError('Could not copy image file %s.' % src_file_path)
+        return src_file_path, dst_file_path
+
+    def add_file(self, src_file_path, dst_file_path):
+        # The file is written under a temporary name and renamed into place, so that a copy cut short doesn't leave a
+        # truncated image at dst_file_path. The name is unique to the thread, since a file can be added by two chunks.
+        temp_file_path = '%s.%d.%d.tmp' % (dst_file_path, os.getpid(), threading.get_ident())
         try:
-            shutil.copyfile(src_file_path, dst_file_path)
-        except IOError as ex:
-            if ex.errno != errno.ENOENT:
-                raise BuilderError('Could not copy image file %s.' % src_file_path)
-            try:
-                os.makedirs(os.path.dirname(dst_file_path))
-                shutil.copyfile(src_file_path, dst_file_path)
-            except IOError:
-                raise BuilderError('Could not copy image file %s.' % src_file_path)
+            if self.link != 'copy' and not self._link_unsupported:
+                try:
+                    link_file(src_file_path, temp_file_path, self.link)
+                    os.replace(temp_file_path, dst_file_path)
+                    return
+                except OSError as ex:
+                    if ex.errno not in LINK_UNSUPPORTED_ERRNOS:
+                        raise
+                    self._link_unsupported = True
+            shutil.copyfile(src_file_path, temp_file_path)
+            os.replace(temp_file_path, dst_file_path)
+        except (IOError, OSError):
+            raise BuilderError('Could not copy image file %s.' % src_file_path)
+        finally:
+            # Also left behind when renaming a hard link over a link to the same file, which does nothing
+            remove_file(temp_file_path)
+
+    def write_category_indices(self, schema, df, dst_dir_path):
+        for column in schema.columns:
+            if column.categories is not None:
+                index = CategoryIndex.from_codes(df[column.name].values, len(column.categories),
+                                                 multi_valued=column.isarray())
+                index.save(dst_dir_path, column.name)
+
+    def decode_image_files(self, file_paths, column_name, dst_dir_path, progress_bar):
+        writer = ArrayStoreWriter(dst_dir_path, column_name)
+        file_paths = list(file_paths)
+        try:
+            # Images are decoded in parallel and written in order
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for array in executor.map(self.decode_file, file_paths, [dst_dir_path] * len(file_paths)):
+                    writer.append(array)
+                    progress_bar.update(1)
+        finally:
+            writer.close()
+
+    def decode_file(self, file_path, dst_dir_path, options=None):
+        # options is a (size, mode) pair that replaces the size and mode of the builder
+        size, mode = options or (self.image_size, self.image_mode)
+        image_file_path = os.path.join(dst_dir_path, 'images', file_path)
+        return decode_image(image_file_path, size=size, mode=mode)
 
 
 class BuilderError(BrineError):
     pass
 
 
+# Errors meaning that the files can't be linked, eg. because they are on different filesystems
+LINK_UNSUPPORTED_ERRNOS = frozenset(code for code in (
+    errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTTY, errno.EINVAL, errno.EOPNOTSUPP,
+    getattr(errno, 'ENOTSUP', None), getattr(errno, 'ENOSYS', None)) if code is not None)
+
+
+def link_file(src_file_path, dst_file_path, link):
+    """Creates dst_file_path as a hard link ('hardlink') or a copy-on-write clone ('reflink') of src_file_path.
+
+    Raises an OSError if the filesystem doesn't support it.
+    """
+    if link == 'hardlink':
+        os.link(src_file_path, dst_file_path)
+        return
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are only supported on Linux.')
+    import fcntl
+    with open(src_file_path, 'rb') as src_file:
+        with open(dst_file_path, 'wb') as dst_file:
+            try:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+                return
+            except OSError as ex:
+                error = ex
+    # Don't leave an empty file behind
+    os.remove(dst_file_path)
+    raise error
+
+
+def replace_attr(rootdir, ctable, name, value):
+    """Sets an attribute of a bcolz table and returns the table opened again.
+
+    bcolz rewrites its attrs file in place, so a crash while writing it would lose all the attributes. The file is
+    written under a temporary name and renamed over the old one instead. Rows appended to the table are flushed first.
+    """
+    ctable.flush()
+    attrs = ctable.attrs.getall()
+    attrs[name] = value
+    attrs_path = os.path.join(rootdir, ATTRS_FILE_NAME)
+    temp_attrs_path = attrs_path + '.tmp'
+    try:
+        with open(temp_attrs_path, 'wb') as f:
+            f.write(json.dumps(attrs, ensure_ascii=True).encode('ascii'))
+            f.write(b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_attrs_path, attrs_path)
+    except (IOError, OSError):
+        remove_file(temp_attrs_path)
+        raise BuilderError('Could not write file %s.' % attrs_path)
+    return bcolz.open(rootdir, mode='a')
+
+
+def remove_file(file_path):
+    try:
+        os.remove(file_path)
+    except OSError as ex:
+        if ex.errno != errno.ENOENT:
+            raise
+
+
+def widen_column(rootdir, ctable, name, width):
+    """Replaces a fixed-width string column of a bcolz table with a wider one if its values are shorter than width.
+
+    The wider column is fully written next to the old one before the column directories are swapped, so the old
+    column can be put back by :func:`restore_columns` if the swap is interrupted. The table must be reopened
+    afterwards. Returns whether the column was widened.
+    """
+    carray = ctable.cols[name]
+    dtype = carray.dtype
+    if dtype.kind not in 'SU' or dtype.itemsize // (4 if dtype.kind == 'U' else 1) >= width:
+        return False
+    column_path = os.path.join(rootdir, name)
+    new_column_path = column_path + NEW_COLUMN_SUFFIX
+    old_column_path = column_path + OLD_COLUMN_SUFFIX
+    try:
+        shutil.rmtree(new_column_path, ignore_errors=True)
+        widened = bcolz.carray(carray[:].astype('%s%d' % (dtype.kind, width)), rootdir=new_column_path, mode='w',
+                               cparams=carray.cparams, chunklen=carray.chunklen)
+        widened.flush()
+        os.rename(column_path, old_column_path)
+        os.rename(new_column_path, column_path)
+        shutil.rmtree(old_column_path)
+    except (IOError, OSError):
+        restore_columns(rootdir)
+        raise BuilderError('Could not widen column %s.' % name)
+    return True
+
+
+def restore_columns(rootdir):
+    """Finishes or undoes the column swaps of :func:`widen_column` that were interrupted."""
+    if not os.path.isdir(rootdir):
+        return
+    for dir_name in os.listdir(rootdir):
+        path = os.path.join(rootdir, dir_name)
+        if dir_name.endswith(OLD_COLUMN_SUFFIX):
+            column_path = path[:-len(OLD_COLUMN_SUFFIX)]
+            if os.path.isdir(column_path):
+                shutil.rmtree(path)
+            else:
+                # The new column was not moved in yet
+                os.rename(path, column_path)
+    for dir_name in os.listdir(rootdir):
+        if dir_name.endswith(NEW_COLUMN_SUFFIX):
+            shutil.rmtree(os.path.join(rootdir, dir_name))
+
+
+def column_array(values, dtype):
+    """Converts the values of a csv column to a numpy array of the given dtype. Lists stay lists in object arrays."""
+    if np.dtype(dtype) != object:
+        return np.asarray(values, dtype=dtype)
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
 class CategoryConverter(object):
 
-    def __init__(self):
-        self.categories_dict = {}
+    def __init__(self, categories=None):
+        # Existing categories keep their codes, new ones are numbered after them
+        self.categories_dict = {category: i for i, category in enumerate(categories or [])}
 
     def __call__(self, value):
         if value not in self.categories_dict:
@@ -0,0 +1,176 @@
+import os
+import numpy as np
+
+from brine.exceptions import BrineError
+
+
+INDEX_DIR_NAME = 'index'
+
+
+class CategoryIndex(object):
+    """An inverted index from the categories of a Category or CategoryArray column to the rows that have them.
+
+    The row ids of all the categories are stored in one sorted-by-category array, with an offsets array that gives
+    where the rows of each category start, like a CSR sparse matrix. The rows of each category are sorted.
+
+    Parameters
+    ----------
+    offsets : numpy array
+        Array of num_categories + 1 offsets into rows.
+    rows : numpy array
+        The row ids of each category, one category after the other.
+    """
+
+    def __init__(self, offsets, rows):
+        self.offsets = offsets
+        self.rows = rows
+
+    @classmethod
+    def load(cls, dataset_path, column_name):
+        path = _index_path(dataset_path, column_name)
+        try:
+            with np.load(path) as data:
+                return cls(data['offsets'], data['rows'])
+        except (IOError, KeyError, ValueError):
+            raise CategoryIndexError('Could not load category index %s.' % path)
+
+    @classmethod
+    def from_codes(cls, codes, num_categories, multi_valued=False):
+        """Creates the index of a column from the category codes of each row.
+
+        Parameters
+        ----------
+        codes : numpy array or list of lists
+            The category code of each row, or for a CategoryArray column, the list of codes of each row.
+        num_categories : int
+            The number of categories of the column.
+        multi_valued : bool
+            Whether each row has a list of codes, as in a CategoryArray column. Defaults to False.
+        """
+        offsets, rows = category_postings(codes, num_categories, multi_valued)
+        return cls(offsets, rows)
+
+    @classmethod
+    def from_chunks(cls, read_chunks, num_categories, multi_valued=False):
+        """Creates the index of a column from consecutive chunks of rows, without reading the whole column at once.
+
+        Parameters
+        ----------
+        read_chunks : callable
+            Returns an iterable over the chunks of codes of the column, in order. It is called twice.
+        num_categories : int
+            The number of categories of the column.
+        multi_valued : bool
+            Whether each row has a list of codes, as in a CategoryArray column. Defaults to False.
+        """
+        offsets, rows = chunked_category_postings(read_chunks, num_categories, multi_valued)
+        return cls(offsets, rows)
+
+    @staticmethod
+    def exists(dataset_path, column_name):
+        return os.path.isfile(_index_path(dataset_path, column_name))
+
+    def save(self, dataset_path, column_name):
+        dir_path = os.path.join(dataset_path, INDEX_DIR_NAME)
+        try:
+            os.makedirs(dir_path)
+        except OSError:
+            if not os.path.isdir(dir_path):
+                raise CategoryIndexError('Could not create directory %s.' % dir_path)
+        np.savez(_index_path(dataset_path, column_name), offsets=self.offsets, rows=self.rows)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def counts(self):
+        """Returns the number of rows of each category."""
+        return np.diff(self.offsets)
+
+    def category_rows(self, code):
+        """Returns the sorted row ids of a category as a read-only view."""
+        if not 0 <= code < len(self):
+            raise CategoryIndexError('Category code %s is out of range.' % code)
+        rows = self.rows[self.offsets[code]:self.offsets[code + 1]]
+        rows.flags.writeable = False
+        return rows
+
+    def union(self, codes):
+        """Returns the sorted row ids of the rows that have at least one of the categories."""
+        codes = sorted(set(codes))
+        if not codes:
+            return np.zeros(0, dtype=np.int64)
+        if len(codes) == 1:
+            return self.category_rows(codes[0]).astype(np.int64)
+        return np.unique(np.concatenate([self.category_rows(code) for code in codes])).astype(np.int64)
+
+
+class CategoryIndexError(BrineError):
+    pass
+
+
+def category_postings(codes, num_categories, multi_valued=False):
+    """Returns the (offsets, rows) arrays of the inverted index of a column. See :class:`CategoryIndex`."""
+    codes, row_ids = _flatten_codes(codes, multi_valued)
+    order = np.argsort(codes, kind='mergesort')
+    offsets = _offsets(np.bincount(codes, minlength=num_categories))
+    return offsets, row_ids[order].astype(_rows_dtype(len(row_ids) and row_ids.max()))
+
+
+def chunked_category_postings(read_chunks, num_categories, multi_valued=False):
+    """Returns the (offsets, rows) arrays of the inverted index of a column from consecutive chunks of rows.
+
+    Only one chunk of codes is held in memory at a time, besides the index itself. `read_chunks` is called twice and
+    must return an iterable over the same chunks of codes each time: the rows of each category are counted first, and
+    then written in place.
+    """
+    counts = np.zeros(num_categories, dtype=np.int64)
+    num_rows = 0
+    for chunk in read_chunks():
+        codes, _ = _flatten_codes(chunk, multi_valued)
+        counts += np.bincount(codes, minlength=num_categories)
+        num_rows += len(chunk)
+    offsets = _offsets(counts)
+    rows = np.empty(offsets[-1], dtype=_rows_dtype(num_rows - 1))
+
+    cursors = offsets[:-1].copy()
+    start = 0
+    for chunk in read_chunks():
+        codes, row_ids = _flatten_codes(chunk, multi_valued, start)
+        start += len(chunk)
+        order = np.argsort(codes, kind='mergesort')
+        sorted_codes = codes[order]
+        chunk_counts = np.bincount(codes, minlength=num_categories)
+        # Rank of each row among the rows of the chunk with the same category
+        ranks = np.arange(len(sorted_codes)) - (np.cumsum(chunk_counts) - chunk_counts)[sorted_codes]
+        rows[cursors[sorted_codes] + ranks] = row_ids[order]
+        cursors += chunk_counts
+    return offsets, rows
+
+
+def _flatten_codes(codes, multi_valued, start=0):
+    # Returns the codes and the row ids of a chunk of rows, with one entry per (row, category) pair
+    if not multi_valued:
+        codes = np.asarray(codes, dtype=np.int64)
+        return codes, np.arange(start, start + len(codes))
+    lengths = np.fromiter((len(row_codes) for row_codes in codes), dtype=np.int64, count=len(codes))
+    row_ids = np.repeat(np.arange(len(codes)), lengths)
+    codes = np.fromiter((code for row_codes in codes for code in row_codes), dtype=np.int64,
+                        count=int(lengths.sum()))
+    # A row lists each of its categories once in the index
+    pairs = np.unique(codes * max(len(lengths), 1) + row_ids)
+    codes, row_ids = np.divmod(pairs, max(len(lengths), 1))
+    return codes, row_ids + start
+
+
+def _offsets(counts):
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def _rows_dtype(max_row_id):
+    return np.int32 if max_row_id <= np.iinfo(np.int32).max else np.int64
+
+
+def _index_path(dataset_path, column_name):
+    return os.path.join(dataset_path, INDEX_DIR_NAME, column_name + '.npz')
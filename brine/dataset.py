@@ -1,31 +1,32 @@
 import json
-import random
-import itertools
 import os
-from collections import namedtuple
-from PIL import Image
+import threading
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import bcolz
+import numpy as np
 
-from brine.schema import Schema
+from brine.schema import Schema, SchemaError, Integer, Float
+from brine.query import translate_query, equality_query
+from brine.image_cache import ImageCache
+from brine.array_store import ArrayStore
+from brine.category_index import CategoryIndex
+from brine.sampler import Sampler, DistributedSampler, WeightedSampler, SamplerError, class_weights
 from brine.dataset_manager import DatasetManager
 from brine.exceptions import BrineError
 
 
-def load_dataset(dataset_name, base_path=None):
-    """Load a brine dataset that has been installed with `brine install`.
+DEFAULT_IMAGE_WORKERS = min(8, os.cpu_count() or 1)
 
-    Parameters
-    ----------
-    dataset_name : str
-        The full name of the dataset to load (eg. examples/cifar10)
-    base_path : str
-        The path where the dataset was installed. If None, defaults to the current working directory.
-    Returns
-    -------
-    :class:`~brine.dataset.Dataset`
-    """
+# Sorted indices spanning at most this many times their number of rows are read with a slice
+SLICE_READ_RATIO = 4
+
+
+def load_dataset(dataset_name, base_path=None, columns=None, image_cache_size=None):
+    """Load a brine dataset that has been installed with `brine install`. See :func:`brine.load_dataset`."""
     dataset_manager = DatasetManager.get_from_dir(dataset_name, base_path or os.getcwd())
-    return Dataset(dataset_manager)
+    image_cache = ImageCache(image_cache_size) if image_cache_size else None
+    return Dataset(dataset_manager, columns=columns, image_cache=image_cache)
 
 
 class Dataset(object):
@@ -36,52 +37,104 @@ class Dataset(object):
 
     For most cases, use the :func:`~brine.load_dataset` convenience method to load a dataset and return
     a Dataset.
+
+    Datasets can be pickled, which only pickles the location of the dataset and the rows and columns to use, so they
+    can be sent to PyTorch DataLoader worker processes. Each process opens the dataset files on its own.
     """
 
-    def __init__(self, dataset_manager, indices=None):
+    def __init__(self, dataset_manager, indices=None, columns=None, image_cache=None):
         """
         Parameters
         ----------
         dataset : Dataset
             A brine.Dataset representing the dataset to load.
-        indices : list of int
-            The indices of the original dataset to use for this dataset. Used for creating folds.
+        indices : range, numpy array or list of int
+            The indices of the original dataset to use for this dataset. Used for creating folds. Ranges are kept as
+            is and other sequences are stored as an int64 numpy array.
+        columns : list of str
+            The names of the columns to read. If None, all the columns are read.
+        image_cache : :class:`~brine.image_cache.ImageCache`
+            The cache to keep decoded images in. If None, images are decoded every time they are loaded.
         """
         self.dataset_manager = dataset_manager
+        if indices is not None and not isinstance(indices, range):
+            indices = np.asarray(indices, dtype=np.int64)
         self.indices = indices
-
-        try:
-            self.metadata = bcolz.open(os.path.join(self.dataset_manager.path, 'bcolz'), mode='r')
-        except IOError:
-            raise DatasetError('Dataset %s could not be loaded.' % self.dataset_manager.name)
+        self.image_cache = image_cache
+        self._array_stores = {}
+        self._category_indices = {}
+        self._metadata = None
+        self._metadata_pid = None
 
         self.schema = Schema.from_obj(json.loads(self.metadata.attrs['schema']))
+        if columns is None:
+            self.selected_columns = list(self.schema.columns)
+        else:
+            columns_by_name = {column.name: column for column in self.schema.columns}
+            missing = [name for name in columns if name not in columns_by_name]
+            if missing:
+                raise DatasetError('Dataset %s has no column %s.' % (self.dataset_manager.name, ', '.join(missing)))
+            self.selected_columns = [columns_by_name[name] for name in columns]
+
         self.converters = {}
-        for i, column in enumerate(self.schema.columns):
+        for column in self.selected_columns:
             if column.categories:
                 if column.isarray():
-                    converter = ArrayConverter(CategoryConverter(column.categories))
-                    self.converters[i] = converter
+                    self.converters[column.name] = ArrayConverter(CategoryConverter(column.categories))
                 else:
-                    converter = CategoryConverter(column.categories)
-                    self.converters[i] = converter
+                    self.converters[column.name] = CategoryConverter(column.categories)
 
         self.extra_data = json.loads(self.metadata.attrs['extra_data'])
-        self.Row = namedtuple('Row', [column.name for column in self.schema.columns])
-        self.Column = namedtuple('Column', [column.name for column in self.schema.columns])
+        self.Row = picklable_namedtuple('Row', [column.name for column in self.selected_columns])
+        self.Column = picklable_namedtuple('Column', [column.name for column in self.selected_columns])
 
     def __repr__(self):
         return 'Dataset(name=%s, path=%s)' % (self.dataset_manager.name, self.dataset_manager.path)
 
-    def create_folds(self, fold_sizes, shuffle=False):
+    @property
+    def metadata(self):
+        """The bcolz ctable holding the rows of the dataset.
+
+        The ctable is opened on first use, and opened again in child processes after a fork so that processes
+        never share file handles.
+        """
+        if self._metadata is None or self._metadata_pid != os.getpid():
+            try:
+                self._metadata = bcolz.open(os.path.join(self.dataset_manager.path, 'bcolz'), mode='r')
+            except IOError:
+                raise DatasetError('Dataset %s could not be loaded.' % self.dataset_manager.name)
+            self._metadata_pid = os.getpid()
+        return self._metadata
+
+    def __getstate__(self):
+        # Only pickle what's needed to open the dataset again, so that sending a Dataset to
+        # DataLoader worker processes is cheap. The ctable is opened again in the worker.
+        return {
+            'dataset_manager': self.dataset_manager,
+            'indices': self.indices,
+            'columns': self.column_names,
+            'image_cache_size': self.image_cache.max_bytes if self.image_cache is not None else None,
+        }
+
+    def __setstate__(self, state):
+        image_cache_size = state['image_cache_size']
+        self.__init__(state['dataset_manager'], indices=state['indices'], columns=state['columns'],
+                      image_cache=ImageCache(image_cache_size) if image_cache_size else None)
+
+    def create_folds(self, fold_sizes, shuffle=False, seed=None):
         """Returns sub-datasets from this dataset. Useful for creating training and validation folds.
 
+        Folds only hold the indices of their rows, as a range or a numpy array. Without shuffling, the folds of a
+        dataset (or of a fold) are slices of its indices, so no index is copied.
+
         Parameters
         ----------
         fold_sizes : list of int
             Sizes of the folds to create.
         shuffle : bool
             Whether to shuffle the dataset before creating folds. Defaults to False.
+        seed : int
+            Seed to use for the random number generator when shuffling. Defaults to None.
 
         Returns
         -------
@@ -91,21 +144,346 @@ class Dataset(object):
         """
         total = sum(fold_sizes)
         if total > len(self):
-            raise DatasetError
-        if self.indices is not None:
-            indices = self.indices
-        else:
-            indices = list(range(0, len(self)))
+            raise DatasetError('Fold sizes add up to %d but dataset %s only has %d rows.' % (
+                total, self.dataset_manager.name, len(self)))
         if shuffle:
-            indices = random.sample(indices, len(self))
-        iterator = iter(indices)
-        slices = [s for s in (list(itertools.islice(iterator, 0, i)) for i in fold_sizes)]
-        remaining = list(iterator)
-        slices.append(remaining)
-        folds = [Dataset(self.dataset_manager, indices=s) for s in slices]
+            indices = self._real_indices(np.random.default_rng(seed).permutation(len(self)))
+        else:
+            indices = self._indices_or_range()
+        return self._split(indices, fold_sizes)
+
+    def kfold(self, k, shuffle=False, seed=None, stratify=None):
+        """Returns k pairs of (training, validation) sub-datasets for k-fold cross-validation.
+
+        The rows are split in k parts of nearly equal size. Each part is used once as the validation fold, with the
+        other parts as the training fold.
+
+        Parameters
+        ----------
+        k : int
+            The number of folds.
+        shuffle : bool
+            Whether to shuffle the dataset before splitting it. Defaults to False.
+        seed : int
+            Seed to use for the random number generator when shuffling. Defaults to None.
+        stratify : str
+            The name of a Category column. If set, each part has about the same proportion of each category as the
+            whole dataset, and the rows are always shuffled. Defaults to None.
+
+        Returns
+        -------
+        list of (Dataset, Dataset)
+        """
+        if not 1 < k <= len(self):
+            raise DatasetError('Cannot split dataset %s of %d rows in %s folds.' % (
+                self.dataset_manager.name, len(self), k))
+        if stratify is not None:
+            indices = self._real_indices(self._stratified_order(stratify, seed))
+        elif shuffle:
+            indices = self._real_indices(np.random.default_rng(seed).permutation(len(self)))
+        else:
+            indices = self._indices_or_range()
+        bounds = [len(self) * i // k for i in range(k + 1)]
+        folds = []
+        for i in range(k):
+            validation = indices[bounds[i]:bounds[i + 1]]
+            training = np.concatenate([np.asarray(indices[:bounds[i]], dtype=np.int64),
+                                       np.asarray(indices[bounds[i + 1]:], dtype=np.int64)])
+            folds.append((self._view(training), self._view(validation)))
         return folds
 
-    def to_keras(self, x_column, y_column=None, batch_size=32, processing_function=None, shuffle=True, seed=None):
+    def stratified_folds(self, column_name, fold_sizes, seed=None):
+        """Returns shuffled sub-datasets that each have about the same proportion of each category as this dataset.
+
+        Works like :meth:`~brine.dataset.Dataset.create_folds` with shuffle=True, except that the categories of a
+        Category column are spread evenly across the folds.
+
+        Parameters
+        ----------
+        column_name : str
+            The name of the Category column to stratify on.
+        fold_sizes : list of int
+            Sizes of the folds to create.
+        seed : int
+            Seed to use for the random number generator. Defaults to None.
+
+        Returns
+        -------
+        list of Dataset
+            A list of size len(fold_sizes) + 1 of Dataset for the sub-datasets created.
+            Any rows leftover will always be returned in the last element of the list as a Dataset.
+        """
+        total = sum(fold_sizes)
+        if total > len(self):
+            raise DatasetError('Fold sizes add up to %d but dataset %s only has %d rows.' % (
+                total, self.dataset_manager.name, len(self)))
+        return self._split(self._real_indices(self._stratified_order(column_name, seed)), fold_sizes)
+
+    def _stratified_order(self, column_name, seed):
+        # Orders the rows so that every prefix of the order has about the same proportion of each category:
+        # each row is keyed by its (jittered) rank among the shuffled rows of its category, divided by the size of
+        # its category.
+        column = self._category_column(column_name)
+        if column.isarray():
+            raise DatasetError('Column %s is not a Category column.' % column_name)
+        codes = self._category_codes(column_name)
+        rng = np.random.default_rng(seed)
+        permutation = rng.permutation(len(self))
+        by_category = permutation[np.argsort(codes[permutation], kind='mergesort')]
+        counts = np.bincount(codes, minlength=len(column.categories))
+        starts = np.cumsum(counts) - counts
+        sorted_codes = codes[by_category]
+        ranks = np.arange(len(self)) - starts[sorted_codes]
+        keys = (ranks + rng.random(len(self))) / counts[sorted_codes]
+        return by_category[np.argsort(keys, kind='mergesort')]
+
+    def _split(self, indices, fold_sizes):
+        bounds = np.cumsum([0] + list(fold_sizes))
+        slices = [indices[int(start):int(stop)] for start, stop in zip(bounds[:-1], bounds[1:])]
+        slices.append(indices[int(bounds[-1]):])
+        return [self._view(s) for s in slices]
+
+    def _view(self, indices):
+        view = Dataset(self.dataset_manager, indices=indices, columns=self.column_names, image_cache=self.image_cache)
+        # Category indices cover the whole dataset, so views share them
+        view._category_indices = self._category_indices
+        return view
+
+    def _indices_or_range(self):
+        return self.indices if self.indices is not None else range(len(self))
+
+    def shard(self, rank, world_size):
+        """Returns the part of this dataset that one rank of a distributed job should use.
+
+        Rank r gets the rows r, r + world_size, r + 2 * world_size, etc. The shards of all the ranks are disjoint and
+        their sizes differ by at most one row. To also reshuffle rows across ranks every epoch, use
+        :meth:`~brine.dataset.Dataset.distributed_sampler` on the whole dataset instead.
+
+        Parameters
+        ----------
+        rank : int
+            The rank of this process, between 0 and world_size - 1.
+        world_size : int
+            The number of processes.
+
+        Returns
+        -------
+        Dataset
+        """
+        if world_size < 1 or not 0 <= rank < world_size:
+            raise DatasetError('Rank %s is not valid for world size %s.' % (rank, world_size))
+        return self._view(self._indices_or_range()[rank::world_size])
+
+    def select(self, columns):
+        """Returns a view of this dataset that only reads the given columns.
+
+        Only the selected columns are decompressed when rows are read, which makes reading rows faster and uses
+        less memory when some columns aren't needed.
+
+        Parameters
+        ----------
+        columns : list of str
+            The names of the columns to keep.
+
+        Returns
+        -------
+        Dataset
+            A Dataset with the same rows as this dataset and only the selected columns.
+        """
+        missing = [name for name in columns if name not in self.column_names]
+        if missing:
+            raise DatasetError('Dataset %s has no column %s.' % (self.dataset_manager.name, ', '.join(missing)))
+        return Dataset(self.dataset_manager, indices=self.indices, columns=columns, image_cache=self.image_cache)
+
+    def where(self, expression=None, **values):
+        """Returns a view of the rows of this dataset that match a query.
+
+        The query is evaluated by bcolz over the compressed columns with numexpr, without creating a Python object
+        per row. Category values are translated to their integer codes, so they can be compared with `==` and `!=`,
+        or tested with `in` and `not in` against a list of values.
+
+        Examples::
+
+            dataset.where("label == 'cat' and score > 0.8")
+            dataset.where("label in ['cat', 'dog']")
+            dataset.where(label='cat')
+
+        Parameters
+        ----------
+        expression : str
+            A numexpr expression over the columns of the dataset. Columns that are not selected in this dataset can
+            be used too. Array columns can't be used. Defaults to None.
+        **values
+            Column names and the value each column must be equal to. If a value is a list or a tuple, the column
+            must be equal to one of its elements.
+
+        Returns
+        -------
+        Dataset
+            A Dataset over the matching rows, in the same order as in this dataset.
+        """
+        queries = [query for query in (expression, equality_query(values)) if query]
+        if not queries:
+            return self._view(self._indices_or_range())
+        query = translate_query(' and '.join('(%s)' % query for query in queries), self.schema.columns)
+
+        try:
+            mask = np.asarray(self.metadata.eval(query, out_flavor='numpy'))
+        except (SyntaxError, NameError, KeyError, TypeError, ValueError) as e:
+            raise DatasetError('Could not evaluate query %s on dataset %s: %s' % (
+                query, self.dataset_manager.name, e))
+        if mask.dtype != np.bool_ or mask.shape != (len(self.metadata),):
+            raise DatasetError('Query %s does not return one boolean per row.' % query)
+
+        return self._masked_view(mask)
+
+    def filter_categories(self, column_name, values):
+        """Returns a view of the rows that have one of the given categories.
+
+        Uses the category index written when the dataset was built, so the rows are found without scanning the
+        column. For datasets built without an index, the column is scanned once and the index is kept in memory.
+
+        Parameters
+        ----------
+        column_name : str
+            The name of a Category or CategoryArray column. For a CategoryArray column, rows that have at least one
+            of the categories are kept.
+        values : list of str
+            The categories to keep.
+
+        Returns
+        -------
+        Dataset
+            A Dataset over the matching rows, in the same order as in this dataset.
+        """
+        column = self._category_column(column_name)
+        if isinstance(values, str):
+            values = [values]
+        codes = [self._category_code(column, value) for value in values]
+        rows = self._get_category_index(column_name).union(codes)
+        mask = np.zeros(len(self.metadata), dtype=np.bool_)
+        mask[rows] = True
+        return self._masked_view(mask)
+
+    def category_counts(self, column_name):
+        """Returns the number of rows of this dataset that have each category of a column.
+
+        Parameters
+        ----------
+        column_name : str
+            The name of a Category or CategoryArray column.
+
+        Returns
+        -------
+        OrderedDict
+            The number of rows for each category, in the order of the categories of the column.
+        """
+        column = self._category_column(column_name)
+        return OrderedDict(zip(column.categories, self._category_code_counts(column_name).tolist()))
+
+    def sample_category(self, column_name, value, n, replace=False, seed=None):
+        """Returns a view of n random rows that have a category.
+
+        Parameters
+        ----------
+        column_name : str
+            The name of a Category or CategoryArray column.
+        value : str
+            The category.
+        n : int
+            The number of rows to return.
+        replace : bool
+            Whether rows can be drawn several times. Defaults to False.
+        seed : int
+            Seed to use for the random number generator. Defaults to None.
+
+        Returns
+        -------
+        Dataset
+        """
+        rows = self.filter_categories(column_name, [value])._indices_or_range()
+        if not replace and n > len(rows):
+            raise DatasetError('Cannot sample %d rows of category %s from %d rows.' % (n, value, len(rows)))
+        if len(rows) == 0 and n > 0:
+            raise DatasetError('Dataset %s has no rows of category %s.' % (self.dataset_manager.name, value))
+        positions = np.random.default_rng(seed).choice(len(rows), size=n, replace=replace)
+        return self._view(np.asarray(rows, dtype=np.int64)[positions])
+
+    def has_category_index(self, column_name):
+        """Returns whether a category index for the column was written when the dataset was built."""
+        return CategoryIndex.exists(self.dataset_manager.path, column_name)
+
+    def _get_category_index(self, column_name):
+        category_index = self._category_indices.get(column_name)
+        if category_index is None:
+            if CategoryIndex.exists(self.dataset_manager.path, column_name):
+                category_index = CategoryIndex.load(self.dataset_manager.path, column_name)
+            else:
+                column = self._category_column(column_name)
+                category_index = CategoryIndex.from_codes(self.metadata.cols[column_name][:], len(column.categories),
+                                                          multi_valued=column.isarray())
+            self._category_indices[column_name] = category_index
+        return category_index
+
+    def _category_code_counts(self, column_name):
+        category_index = self._get_category_index(column_name)
+        if self.indices is None:
+            return category_index.counts()
+        mask = np.zeros(len(self.metadata), dtype=np.bool_)
+        mask[self._indices_or_range()] = True
+        in_view = np.zeros(len(category_index.rows) + 1, dtype=np.int64)
+        np.cumsum(mask[category_index.rows], out=in_view[1:])
+        return in_view[category_index.offsets[1:]] - in_view[category_index.offsets[:-1]]
+
+    def _category_codes(self, column_name):
+        # The category code of each row of this dataset, read from the category index
+        category_index = self._get_category_index(column_name)
+        codes = np.empty(len(self.metadata), dtype=np.int64)
+        codes[category_index.rows] = np.repeat(np.arange(len(category_index)), category_index.counts())
+        if self.indices is None:
+            return codes
+        return codes[self._indices_or_range()]
+
+    def _column_values(self, column_name):
+        # The values of a column for each row of this dataset, whether or not the column is selected
+        carray = self.metadata.cols[column_name]
+        if self.indices is None:
+            return carray[:]
+        if isinstance(self.indices, range) and self.indices.step == 1:
+            return carray[self.indices.start:self.indices.stop]
+        return carray[self._real_indices(np.arange(len(self)))]
+
+    def _schema_column(self, column_name):
+        for column in self.schema.columns:
+            if column.name == column_name:
+                return column
+        raise DatasetError('Dataset %s has no column %s.' % (self.dataset_manager.name, column_name))
+
+    def _category_column(self, column_name):
+        column = self._schema_column(column_name)
+        if column.categories is None:
+            raise DatasetError('Column %s is not a category column.' % column_name)
+        return column
+
+    def _category_code(self, column, value):
+        try:
+            return column.category_index(value)
+        except SchemaError as e:
+            raise DatasetError(str(e))
+
+    def _masked_view(self, mask):
+        # Keeps the rows of this dataset whose real index is set in mask, in the order of this dataset
+        if self.indices is None:
+            return self._view(np.flatnonzero(mask))
+        indices = self.indices
+        if isinstance(indices, range) and indices.step == 1:
+            return self._view(indices.start + np.flatnonzero(mask[indices.start:indices.stop]))
+        indices = np.asarray(indices, dtype=np.int64)
+        return self._view(indices[mask[indices]])
+
+    def to_keras(self, x_column, y_column=None, batch_size=32, processing_function=None, shuffle=True, seed=None,
+                 image_workers=None, block_size=None, buffer_blocks=4, prefetch=0, workers=1, ring_buffers=0,
+                 sampler=None, target_size=None, image_mode=None):
         """Creates a generator that can be used with Keras' fit_generator.
 
         Parameters
@@ -126,7 +504,35 @@ class Dataset(object):
         shuffle : bool
             Whether to returned the rows in random order. Defaults to True.
         seed : int
-            Seed to use for the random number generator.
+            Seed to use for the random number generator. The generator uses its own random state and doesn't change
+            numpy's global random state. The position of the generator can be saved with `state_dict()` and restored
+            with `load_state_dict()`.
+        image_workers : int
+            The number of threads used to decode the images of a batch. See :meth:`~brine.dataset.Dataset.load_images`.
+            Defaults to None.
+        block_size : int or 'chunk'
+            If set, rows are shuffled by blocks of block_size consecutive rows, so that each batch reads from fewer
+            compressed chunks. See :meth:`~brine.dataset.Dataset.sampler`. Defaults to None.
+        buffer_blocks : int
+            How many blocks rows are mixed across when block_size is set. Defaults to 4.
+        prefetch : int
+            The number of batches to assemble ahead of time in background threads, while the model trains on the
+            current batch. If 0, batches are assembled when they are requested. Defaults to 0.
+        workers : int
+            The number of background threads that assemble batches when prefetch is set. Defaults to 1.
+        ring_buffers : int
+            If set, batches are written to this many preallocated arrays that are reused in turn, instead of new
+            arrays. A returned batch is overwritten ring_buffers batches later, so this must be larger than the number
+            of batches held at once, including the prefetched batches and Keras' own queue. Defaults to 0.
+        sampler : :class:`~brine.sampler.Sampler`
+            The sampler that gives the order of the rows for each epoch. If set, shuffle, seed, block_size and
+            buffer_blocks are ignored. Defaults to None.
+        target_size : tuple of int
+            The (height, width) to resize images to when they are loaded, in the same order as Keras'
+            `load_img`. JPEG images are decoded at a reduced scale when possible. See
+            :meth:`~brine.dataset.Dataset.load_image`. Defaults to None.
+        image_mode : str
+            The PIL mode to convert images to when they are loaded. Defaults to None.
 
         Returns
         -------
@@ -144,13 +550,86 @@ class Dataset(object):
             else:
                 print('Could not find keras. Please install keras before using this method')
                 return None
+        if block_size == 'chunk':
+            block_size = self.chunklen
         return KerasGenerator(self, x_column, y_column,
                               batch_size=batch_size, shuffle=shuffle, processing_function=processing_function,
-                              seed=seed)
+                              seed=seed, image_workers=image_workers, block_size=block_size,
+                              buffer_blocks=buffer_blocks, prefetch=prefetch, workers=workers,
+                              ring_buffers=ring_buffers, sampler=sampler, target_size=target_size,
+                              image_mode=image_mode)
+
+    def to_keras_sequence(self, x_column, y_column=None, batch_size=32, processing_function=None, shuffle=True,
+                          seed=None, image_workers=None, block_size=None, buffer_blocks=4, sampler=None,
+                          target_size=None, image_mode=None):
+        """Creates a `keras.utils.Sequence` that can be used with Keras' fit_generator.
+
+        Unlike :meth:`~brine.dataset.Dataset.to_keras`, batches can be requested by index, so Keras can assemble them
+        in several processes with `use_multiprocessing=True, workers=N` and still get them in a deterministic order.
+        The rows are shuffled again at the end of each epoch.
+
+        Parameters
+        ----------
+        x_column : str
+            The name of the column to treat as the 'x' value
+        y_column : str
+            The name of the column to treat as the 'y' value. Defaults to None.
+        batch_size : int
+            The batch size. Defaults to 32.
+        processing_function
+            Function to apply to each row before it's returned. See :meth:`~brine.dataset.Dataset.to_keras`.
+            It must be picklable to be used with `use_multiprocessing=True`. Defaults to None.
+        shuffle : bool
+            Whether to returned the rows in random order. Defaults to True.
+        seed : int
+            Seed to use for the random number generator.
+        image_workers : int
+            The number of threads used to decode the images of a batch. See :meth:`~brine.dataset.Dataset.load_images`.
+            Defaults to None.
+        block_size : int or 'chunk'
+            If set, rows are shuffled by blocks of block_size consecutive rows. See
+            :meth:`~brine.dataset.Dataset.sampler`. Defaults to None.
+        buffer_blocks : int
+            How many blocks rows are mixed across when block_size is set. Defaults to 4.
+        sampler : :class:`~brine.sampler.Sampler`
+            The sampler that gives the order of the rows for each epoch. If set, shuffle, seed, block_size and
+            buffer_blocks are ignored. Defaults to None.
+        target_size : tuple of int
+            The (height, width) to resize images to when they are loaded, in the same order as Keras'
+            `load_img`. See :meth:`~brine.dataset.Dataset.to_keras`. Defaults to None.
+        image_mode : str
+            The PIL mode to convert images to when they are loaded. Defaults to None.
+
+        Returns
+        -------
+        :class:`brine.keras_generator.KerasSequence`
+            A Sequence of length steps_per_epoch() whose items are batches of samples (x, y) (or just x if y_column
+            is None).
+        """
+        try:
+            from brine.keras_generator import KerasSequence
+        except ImportError as e:
+            if e.name != 'keras':
+                raise
+            else:
+                print('Could not find keras. Please install keras before using this method')
+                return None
+        if block_size == 'chunk':
+            block_size = self.chunklen
+        return KerasSequence(self, x_column, y_column,
+                             batch_size=batch_size, shuffle=shuffle, processing_function=processing_function,
+                             seed=seed, image_workers=image_workers, block_size=block_size,
+                             buffer_blocks=buffer_blocks, sampler=sampler, target_size=target_size,
+                             image_mode=image_mode)
 
-    def to_pytorch(self, transform=None, transform_columns=None):
+    def to_pytorch(self, transform=None, transform_columns=None, image_workers=None, target_size=None,
+                   image_mode=None):
         """Creates a PyTorch Dataset that can be passed to a PyTorch DataLoader.
 
+        DataLoaders that support batched fetching read the rows of each batch at once. Pass the
+        :meth:`~brine.pytorch_dataset.PytorchDataset.fast_collate` of the returned dataset as the `collate_fn` of the
+        DataLoader to get batches of uint8 image tensors and label tensors without building a namedtuple per row.
+
         Parameters
         ----------
         transform : callable
@@ -162,6 +641,14 @@ class Dataset(object):
             callable. This is useful to directly apply torchvision transforms on those columns.
             If transform_columns is set to None, the transform function will receive the namedtuple
             representing the entire Row from the Dataset.
+        image_workers : int
+            The number of threads used to decode the images of a row. See :meth:`~brine.dataset.Dataset.load_images`.
+            Defaults to None.
+        target_size : tuple of int
+            The (width, height) to resize images to when they are loaded. JPEG images are decoded at a reduced scale
+            when possible. See :meth:`~brine.dataset.Dataset.load_image`. Defaults to None.
+        image_mode : str
+            The PIL mode to convert images to when they are loaded. Defaults to None.
 
         Returns
         -------
@@ -170,40 +657,504 @@ class Dataset(object):
         try:
             from brine.pytorch_dataset import PytorchDataset
         except ImportError as e:
-            if e.name != 'pytorch':
+            if e.name != 'torch':
+                raise
+            else:
+                print('Could not find pytorch. Please install pytorch before using this method')
+                return None
+        return PytorchDataset(self, transform=transform, transform_columns=transform_columns,
+                              image_workers=image_workers, target_size=target_size, image_mode=image_mode)
+
+    def to_pytorch_iterable(self, shuffle_buffer=0, seed=None, rank=0, world_size=1, chunk_size=None, transform=None,
+                            transform_columns=None, image_workers=None, target_size=None, image_mode=None):
+        """Creates a PyTorch IterableDataset that streams the rows in the order they are stored on disk.
+
+        Unlike :meth:`~brine.dataset.Dataset.to_pytorch`, rows are not read at random: each DataLoader worker of each
+        rank reads runs of consecutive rows, which keeps decompression and image reads sequential. Use it for
+        jobs that scan the dataset, or when a bounded shuffle is random enough.
+
+        Like PyTorch's DistributedSampler, every worker of every rank gets the same number of rows, so that all the
+        ranks run the same number of steps. A few rows are repeated to make the rows split evenly.
+
+        Parameters
+        ----------
+        shuffle_buffer : int
+            If set, the chunks are read in a random order and rows are drawn at random from a buffer of this many
+            rows. If 0, rows are returned in order. Defaults to 0.
+        seed : int
+            Seed to use for the random number generator. Must be the same on all ranks. If None, a random seed is
+            drawn, which is shared by the DataLoader workers but not by other ranks.
+        rank : int
+            The rank of this process in a distributed training job. Defaults to 0.
+        world_size : int
+            The number of processes in a distributed training job. Defaults to 1.
+        chunk_size : int
+            The number of consecutive rows read at once. If None, the chunk length of the dataset is used.
+        transform : callable
+            See :meth:`~brine.dataset.Dataset.to_pytorch`. Defaults to None.
+        transform_columns : 'images' or None
+            See :meth:`~brine.dataset.Dataset.to_pytorch`. Defaults to None.
+        image_workers : int
+            The number of threads used to decode the images of a row. Defaults to None.
+        target_size : tuple of int
+            The (width, height) to resize images to when they are loaded. See :meth:`~brine.dataset.Dataset.to_pytorch`.
+            Defaults to None.
+        image_mode : str
+            The PIL mode to convert images to when they are loaded. Defaults to None.
+
+        Returns
+        -------
+        :class:`~brine.pytorch_dataset.PytorchIterableDataset`
+        """
+        if world_size < 1 or not 0 <= rank < world_size:
+            raise DatasetError('Rank %s is not valid for world size %s.' % (rank, world_size))
+        try:
+            from brine.pytorch_dataset import PytorchIterableDataset
+        except ImportError as e:
+            if e.name != 'torch':
                 raise
             else:
                 print('Could not find pytorch. Please install pytorch before using this method')
                 return None
-        return PytorchDataset(self, transform=transform, transform_columns=transform_columns)
+        return PytorchIterableDataset(self, shuffle_buffer=shuffle_buffer, seed=seed, rank=rank, world_size=world_size,
+                                      chunk_size=chunk_size, transform=transform, transform_columns=transform_columns,
+                                      image_workers=image_workers, target_size=target_size, image_mode=image_mode)
+
+    def sampler(self, shuffle=True, seed=None, block_size=None, buffer_blocks=4):
+        """Creates a sampler that can be passed to a PyTorch DataLoader along with
+        :meth:`~brine.dataset.Dataset.to_pytorch`.
+
+        Shuffling every row of the dataset makes each batch read from many different compressed chunks and image
+        directories. With block_size set, the order of blocks of consecutive rows is shuffled instead, and rows are
+        only mixed with the rows of the next few blocks, which keeps reads mostly sequential while still
+        randomizing batches.
+
+        Parameters
+        ----------
+        shuffle : bool
+            Whether to return the rows in random order. Defaults to True.
+        seed : int
+            Seed to use for the random number generator.
+        block_size : int or 'chunk'
+            The number of consecutive rows to shuffle together. If 'chunk', uses the chunk length of the
+            dataset. If None, every row is shuffled individually. Defaults to None.
+        buffer_blocks : int
+            How many blocks rows are mixed across. Higher values give more random batches. Defaults to 4.
+
+        Returns
+        -------
+        :class:`~brine.sampler.Sampler`
+        """
+        if block_size == 'chunk':
+            block_size = self.chunklen
+        return Sampler(len(self), shuffle=shuffle, seed=seed, block_size=block_size, buffer_blocks=buffer_blocks)
+
+    def distributed_sampler(self, rank, world_size, shuffle=True, seed=0, block_size=None, buffer_blocks=4,
+                            locality=False):
+        """Creates a sampler that gives each rank of a distributed training job its own rows of this dataset.
+
+        Every rank gets the same number of rows, padding with repeated rows if needed, and the rows are reshuffled
+        across ranks every epoch. The sampler can be passed to a PyTorch DataLoader, or to
+        :meth:`~brine.dataset.Dataset.to_keras` with the `sampler` argument. Only integer indices are generated, no
+        Python list of rows is built.
+
+        Parameters
+        ----------
+        rank : int
+            The rank of this process, between 0 and world_size - 1.
+        world_size : int
+            The number of processes.
+        shuffle : bool
+            Whether to return the rows in random order. Defaults to True.
+        seed : int
+            Seed to use for the random number generator. Must be the same on every rank. Defaults to 0.
+        block_size : int or 'chunk'
+            The number of consecutive rows to shuffle together. See :meth:`~brine.dataset.Dataset.sampler`.
+            Defaults to None.
+        buffer_blocks : int
+            How many blocks rows are mixed across when block_size is set. Defaults to 4.
+        locality : bool
+            If True, each rank always reads the same contiguous part of the dataset, and only the order inside it
+            changes between epochs, so that the rows a rank reads stay in its page cache. Defaults to False.
+
+        Returns
+        -------
+        :class:`~brine.sampler.DistributedSampler`
+        """
+        if block_size == 'chunk':
+            block_size = self.chunklen
+        return DistributedSampler(len(self), rank, world_size, shuffle=shuffle, seed=seed, block_size=block_size,
+                                  buffer_blocks=buffer_blocks, locality=locality)
 
-    def load_image(self, image_path, imread_fn=None):
+    def weighted_sampler(self, column_name, mode='inverse', num_samples=None, replacement=True, seed=None):
+        """Creates a sampler that draws rows with weights taken from a column, eg. for class-balanced training.
+
+        Pass it as the `sampler` of :meth:`~brine.dataset.Dataset.to_keras` or
+        :meth:`~brine.dataset.Dataset.to_keras_sequence`, or of a PyTorch DataLoader.
+
+        Parameters
+        ----------
+        column_name : str
+            The name of the column the weights are taken from.
+        mode : str
+            'inverse' to draw every category of a Category column equally often, 'sqrt' to weight the rows of each
+            category by 1 / sqrt(number of rows of the category), or 'column' to use the values of an Integer or
+            Float column as the weights of the rows. Defaults to 'inverse'.
+        num_samples : int
+            The number of rows in an epoch. Defaults to the number of rows in the dataset.
+        replacement : bool
+            Whether rows can be drawn several times in the same epoch. Defaults to True.
+        seed : int
+            Seed to use for the random number generator. If None, a random seed is drawn.
+
+        Returns
+        -------
+        :class:`~brine.sampler.WeightedSampler`
+        """
+        if mode not in ('inverse', 'sqrt', 'column'):
+            raise DatasetError('Unsupported weighting mode %s.' % mode)
+        if mode == 'column':
+            column = self._schema_column(column_name)
+            if not isinstance(column.column_type, (Integer, Float)):
+                raise DatasetError('Column %s is not an Integer or Float column.' % column_name)
+            weights = self._column_values(column_name)
+        else:
+            column = self._category_column(column_name)
+            if column.isarray():
+                raise DatasetError('Cannot balance CategoryArray column %s.' % column_name)
+            weights = class_weights(self._category_code_counts(column_name), mode)[self._category_codes(column_name)]
+        try:
+            return WeightedSampler(weights, num_samples=num_samples, replacement=replacement, seed=seed)
+        except SamplerError as e:
+            raise DatasetError(str(e))
+
+    def load_image(self, image_path, imread_fn=None, target_size=None, mode=None):
         """Get the PIL image for an Image path in the dataset.
 
+        If the dataset has an image cache, the decoded image is returned from the cache when possible. Cached
+        images are shared between calls, so they shouldn't be modified in place.
+
+        When target_size is set, JPEG images are decoded at a reduced scale (1/2, 1/4 or 1/8) with PIL's draft mode
+        before being resized, which is several times faster than decoding large photos at full resolution.
+
         Parameters
         ----------
         image_path : str
             The path to the image in the dataset. This should be retrieved directly from the Row
         imread_fn : callable
             The function to use to read the image. If None, the image will be read with `Image.open`.
+            target_size and mode are only applied to images read with `Image.open`. Defaults to None.
+        target_size : tuple of int
+            The (width, height) to resize the image to. If None, the image keeps its size. Defaults to None.
+        mode : str
+            The PIL mode to convert the image to, eg. 'RGB' or 'L'. If None, the image keeps its mode.
             Defaults to None.
 
         Returns
         -------
         A PIL Image
         """
+        if target_size is not None:
+            target_size = tuple(target_size)
+
+        if self.image_cache is None:
+            return self._read_image(image_path, imread_fn, target_size, mode)
+
+        key = (image_path, imread_fn, target_size, mode)
+        image = self.image_cache.get(key)
+        if image is None:
+            image = self._read_image(image_path, imread_fn, target_size, mode)
+            if hasattr(image, 'load'):
+                image.load()
+            self.image_cache.put(key, image)
+        return image
+
+    def load_images(self, image_paths, imread_fn=None, workers=None, target_size=None, mode=None):
+        """Get the decoded PIL images for several Image paths in the dataset.
+
+        The images are decoded in parallel by a pool of threads, which is shared by all the datasets and reused between
+        calls. PIL releases the GIL while decoding, so this keeps several cores busy.
+
+        Parameters
+        ----------
+        image_paths : list of str
+            The paths to the images in the dataset.
+        imread_fn : callable
+            The function to use to read the images. See :meth:`~brine.dataset.Dataset.load_image`.
+            Defaults to None.
+        workers : int
+            The number of threads to decode the images with. If 0 or 1, the images are decoded in the calling thread.
+            If None, defaults to the number of CPUs, up to 8.
+        target_size : tuple of int
+            The (width, height) to resize the images to. See :meth:`~brine.dataset.Dataset.load_image`.
+            Defaults to None.
+        mode : str
+            The PIL mode to convert the images to. Defaults to None.
+
+        Returns
+        -------
+        list
+            The PIL images, in the same order as `image_paths`. The images are fully loaded.
+        """
+        workers = DEFAULT_IMAGE_WORKERS if workers is None else workers
+        image_paths = list(image_paths)
+        if workers <= 1 or len(image_paths) <= 1:
+            return [self._load_decoded_image(image_path, imread_fn, target_size, mode) for image_path in image_paths]
+        pool = get_thread_pool(workers)
+        return list(pool.map(self._load_decoded_image, image_paths, [imread_fn] * len(image_paths),
+                             [target_size] * len(image_paths), [mode] * len(image_paths)))
 
+    def _load_decoded_image(self, image_path, imread_fn=None, target_size=None, mode=None):
+        image = self.load_image(image_path, imread_fn, target_size, mode)
+        if hasattr(image, 'load'):
+            image.load()
+        return image
+
+    def _read_image(self, image_path, imread_fn, target_size=None, mode=None):
         p = os.path.join(self.dataset_manager.path, 'images', image_path)
-        if imread_fn is None:
-            return Image.open(p)
-        else:
+        if imread_fn is not None:
             return imread_fn(p)
+        from PIL import Image
+        image = Image.open(p)
+        if target_size is not None:
+            # Lets libjpeg decode at the smallest scale that is still at least target_size. No-op for other formats.
+            image.draft(mode, target_size)
+        if mode is not None and image.mode != mode:
+            image = image.convert(mode)
+        if target_size is not None and image.size != target_size:
+            image = image.resize(target_size, Image.BILINEAR)
+        return image
+
+    def _arrays_match(self, column_name, target_size=None, mode=None):
+        # Whether the decoded array file of an Image column can be used in place of images loaded with these options
+        if not self.has_arrays(column_name):
+            return False
+        shape = self._get_array_store(column_name).shape
+        if shape is None:
+            # Images of different sizes can't be read as one batch array
+            return False
+        if target_size is not None and (shape[1], shape[0]) != tuple(target_size):
+            return False
+        if mode is not None:
+            from PIL import Image
+            return Image.getmodebands(mode) == shape[2]
+        return True
+
+    def get_batch(self, indices, columns=None, decode_categories=True):
+        """Reads several rows at once and returns them as columns.
+
+        All the requested rows are read from the bcolz table in a single fancy indexing call per column, in sorted
+        order so that each compressed chunk is only decompressed once. Category columns are decoded for the whole
+        batch at once.
+
+        Parameters
+        ----------
+        indices : list of int or numpy array
+            The indices of the rows to read.
+        columns : list of str
+            The names of the columns to read. If None, all the columns of this dataset are read.
+            Defaults to None.
+        decode_categories : bool
+            Whether to convert category columns to their string values. If False, the integer codes stored in the
+            dataset are returned instead, which is what the framework adapters use as labels. Defaults to True.
+
+        Returns
+        -------
+        OrderedDict
+            A dict mapping each column name to a numpy array with one element per requested row, in the same order
+            as `indices`. Array columns are returned as numpy object arrays of lists.
+        """
+        real_indices = self._real_indices(indices)
+        order = np.argsort(real_indices, kind='mergesort')
+        sorted_indices = real_indices[order]
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(order.size)
+
+        batch = self._read_sorted(sorted_indices, columns, decode_categories)
+        for name, values in batch.items():
+            batch[name] = values[inverse]
+        return batch
+
+    def iter_batches(self, batch_size=None, columns=None, decode_categories=True):
+        """Reads the whole dataset as a sequence of column batches, in the order the rows are stored on disk.
+
+        Rows are read with contiguous slices aligned with the compressed chunks of the dataset, so each chunk is
+        decompressed only once.
+        This is much faster than reading rows one by one for jobs that go through every row.
+
+        For folds, the rows are read in increasing order of their index in the original dataset, which
+        may not be the order of the fold.
+
+        Parameters
+        ----------
+        batch_size : int
+            The number of rows in each batch. If None, defaults to the chunk length of the dataset.
+        columns : list of str
+            The names of the columns to read. If None, all the columns of this dataset are read.
+            Defaults to None.
+        decode_categories : bool
+            Whether to convert category columns to their string values instead of their integer codes.
+            Defaults to True.
+
+        Yields
+        ------
+        OrderedDict
+            A dict mapping each column name to a numpy array, as returned by :meth:`~brine.dataset.Dataset.get_batch`.
+        """
+        batch_size = batch_size or self.chunklen
+        indices = self._indices_or_range()
+        if isinstance(indices, range) and indices.step == 1:
+            start = indices.start
+            # The first batch ends at a chunk boundary, so that the next ones line up with the chunks
+            head = -start % self.chunklen
+            while start < indices.stop:
+                stop = min(start + (head if 0 < head <= batch_size else batch_size), indices.stop)
+                head = 0
+                yield self._read_sorted(slice(start, stop), columns, decode_categories)
+                start = stop
+        else:
+            sorted_indices = np.sort(np.asarray(indices, dtype=np.int64))
+            for start in range(0, sorted_indices.size, batch_size):
+                yield self._read_sorted(sorted_indices[start:start + batch_size], columns, decode_categories)
+
+    def _read_sorted(self, sorted_indices, columns, decode_categories):
+        # Reads rows given as a slice or as sorted indices. Indices that are close enough together are read as
+        # one slice, which decompresses whole chunks at once instead of going through bcolz fancy indexing.
+        if isinstance(sorted_indices, slice):
+            key = sorted_indices
+            take = None
+        elif sorted_indices.size == 0:
+            key = slice(0, 0)
+            take = None
+        elif sorted_indices[-1] - sorted_indices[0] < SLICE_READ_RATIO * sorted_indices.size:
+            key = slice(int(sorted_indices[0]), int(sorted_indices[-1]) + 1)
+            take = sorted_indices - sorted_indices[0]
+        else:
+            key = sorted_indices
+            take = None
+
+        if columns is None:
+            selected_columns = self.selected_columns
+        else:
+            selected_columns = [getattr(self.columns, name) for name in columns]
+
+        batch = OrderedDict()
+        for column in selected_columns:
+            values = np.asarray(self.metadata.cols[column.name][key])
+            if take is not None:
+                values = values[take]
+            converter = self.converters.get(column.name)
+            if converter is not None and decode_categories:
+                values = converter.convert_batch(values)
+            batch[column.name] = values
+        return batch
+
+    def get_rows(self, indices, decode_categories=True):
+        """Reads several rows at once.
+
+        Parameters
+        ----------
+        indices : list of int or numpy array
+            The indices of the rows to read.
+        decode_categories : bool
+            Whether to convert category columns to their string values instead of their integer codes.
+            Defaults to True.
+
+        Returns
+        -------
+        list of Row namedtuple
+        """
+        return self._batch_rows(self.get_batch(indices, decode_categories=decode_categories))
+
+    def _batch_rows(self, batch):
+        return [self.Row(*values) for values in zip(*(column.tolist() for column in batch.values()))]
+
+    def has_arrays(self, column_name):
+        """Returns whether the Image column was decoded into an array file when the dataset was built.
+
+        See :meth:`~brine.dataset.Dataset.load_array`.
+        """
+        return column_name in self._array_stores or ArrayStore.exists(self.dataset_manager.path, column_name)
+
+    def load_array(self, column_name, index):
+        """Get the decoded image of an Image column for a row, without decoding the image file.
+
+        This only works for datasets built with `brine build --decode-images`.
+
+        Parameters
+        ----------
+        column_name : str
+            The name of the Image column.
+        index : int
+            The index of the row.
+
+        Returns
+        -------
+        numpy array
+            A read-only (height, width, channels) uint8 array. The array is a view on a memory-mapped file, so no
+            data is copied.
+        """
+        return self._get_array_store(column_name)[int(self._real_indices([index])[0])]
+
+    def load_arrays(self, column_name, indices):
+        """Get the decoded images of an Image column for several rows. See :meth:`~brine.dataset.Dataset.load_array`.
+
+        Returns
+        -------
+        numpy array
+            A (len(indices), height, width, channels) uint8 array. All the images must have the same shape.
+        """
+        return self._get_array_store(column_name).get_batch(self._real_indices(indices))
+
+    def _get_array_store(self, column_name):
+        array_store = self._array_stores.get(column_name)
+        if array_store is None:
+            if not ArrayStore.exists(self.dataset_manager.path, column_name):
+                raise DatasetError('Column %s of dataset %s has no decoded images.' % (
+                    column_name, self.dataset_manager.name))
+            array_store = ArrayStore(self.dataset_manager.path, column_name)
+            self._array_stores[column_name] = array_store
+        return array_store
+
+    def _real_indices(self, indices):
+        positions = np.asarray(indices, dtype=np.int64).reshape(-1)
+        length = len(self)
+        if positions.size and (positions.min() < -length or positions.max() >= length):
+            raise IndexError('Index out of range for dataset of length %d.' % length)
+        positions = np.where(positions < 0, positions + length, positions)
+        if self.indices is None:
+            return positions
+        if isinstance(self.indices, range):
+            return self.indices.start + positions * self.indices.step
+        return self.indices[positions]
+
+    def _is_sorted(self):
+        if self.indices is None:
+            return True
+        if isinstance(self.indices, range):
+            return self.indices.step > 0
+        return bool((np.diff(self.indices) > 0).all())
 
     @property
     def columns(self):
         """Returns a list of Column objects containing information about each column in the dataset
         """
-        return self.Column(*self.schema.columns)
+        return self.Column(*self.selected_columns)
+
+    @property
+    def chunklen(self):
+        """The number of rows in each compressed chunk of the dataset.
+
+        bcolz sizes the chunks of each column from its dtype, so this is the largest chunk length of the selected
+        columns: reading this many rows decompresses at most one or two chunks of every column.
+        """
+        return max(self.metadata.cols[column.name].chunklen for column in self.selected_columns)
+
+    @property
+    def column_names(self):
+        """Returns the names of the columns in the dataset
+        """
+        return [column.name for column in self.selected_columns]
 
     def __enter__(self):
         return self
@@ -218,16 +1169,9 @@ class Dataset(object):
         Row namedtuple
             A namedtuple for the row at the given index.
         """
-        if index > len(self):
+        if index >= len(self) or index < -len(self):
             raise IndexError
-        if self.indices is None:
-            real_index = index
-        else:
-            real_index = self.indices[index]
-        row = list(self.metadata[real_index].item())
-        for i, converter in self.converters.items():
-            row[i] = converter(row[i])
-        return self.Row(*row)
+        return self.get_rows([index])[0]
 
     def __len__(self):
         """
@@ -248,21 +1192,72 @@ class Dataset(object):
 class LoaderIter(object):
 
     def __init__(self, loader):
-        self.i = 0
         self.loader = loader
+        self.rows = self._iter_rows()
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        if self.i < len(self.loader):
-            self.i = self.i + 1
-            return self.loader[self.i - 1]
-        else:
-            raise StopIteration
+        return next(self.rows)
 
     next = __next__
 
+    def _iter_rows(self):
+        if self.loader._is_sorted():
+            batches = self.loader.iter_batches()
+        else:
+            # Folds in random order are still read a chunk's worth of rows at a time to keep the order of the fold
+            chunklen = self.loader.chunklen
+            batches = (self.loader.get_batch(np.arange(start, min(start + chunklen, len(self.loader))))
+                       for start in range(0, len(self.loader), chunklen))
+        for batch in batches:
+            for row in self.loader._batch_rows(batch):
+                yield row
+
+
+_namedtuple_classes = {}
+
+
+def picklable_namedtuple(typename, field_names):
+    """Returns a namedtuple class whose instances can be pickled even though the class is created at runtime.
+
+    Classes are cached by type name and fields, and instances are pickled as their fields and values.
+    """
+    key = (typename, tuple(field_names))
+    cls = _namedtuple_classes.get(key)
+    if cls is None:
+        cls = namedtuple(typename, field_names)
+        cls.__reduce__ = lambda self: (_make_namedtuple, (typename, self._fields, tuple(self)))
+        _namedtuple_classes[key] = cls
+    return cls
+
+
+def _make_namedtuple(typename, field_names, values):
+    return picklable_namedtuple(typename, field_names)(*values)
+
+
+_thread_pools = {}
+_thread_pools_pid = None
+_thread_pools_lock = threading.Lock()
+
+
+def get_thread_pool(workers):
+    """Returns a thread pool with the given number of workers, shared by the whole process.
+
+    Pools are recreated after a fork, since the threads of the parent process don't exist in the child.
+    """
+    global _thread_pools_pid
+    with _thread_pools_lock:
+        if _thread_pools_pid != os.getpid():
+            _thread_pools.clear()
+            _thread_pools_pid = os.getpid()
+        pool = _thread_pools.get(workers)
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=workers)
+            _thread_pools[workers] = pool
+        return pool
+
 
 class DatasetError(BrineError):
     pass
@@ -272,10 +1267,14 @@ class CategoryConverter(object):
 
     def __init__(self, categories):
         self.categories = categories
+        self.categories_array = np.array(categories, dtype=object)
 
     def __call__(self, value):
         return self.categories[value]
 
+    def convert_batch(self, values):
+        return self.categories_array[np.asarray(values, dtype=np.int64)]
+
 
 class ArrayConverter(object):
 
@@ -284,3 +1283,15 @@ class ArrayConverter(object):
 
     def __call__(self, value):
         return [self.items_converter(x) for x in value]
+
+    def convert_batch(self, values):
+        return object_array([self.items_converter.convert_batch(value).tolist() for value in values])
+
+
+def object_array(items):
+    """Builds a 1-d numpy object array from a list, even when the items are themselves sequences of equal length.
+    """
+    array = np.empty(len(items), dtype=object)
+    for i, item in enumerate(items):
+        array[i] = item
+    return array
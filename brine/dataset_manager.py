@@ -110,6 +110,13 @@ class DatasetManager(object):
         if self.version() is not None:
             raise DatasetManagerError('Dataset %s has already been pushed.' % self.name)
 
+    def check_can_append(self):
+        if not self.exists():
+            raise DatasetManagerError('Dataset %s is not installed.' % self.name)
+
+        if self.version() is not None:
+            raise DatasetManagerError('Dataset %s has been pushed or installed and cannot be appended to.' % self.name)
+
     def create_from_dir(self, source_path, version=None):
         if self.exists():
             raise DatasetManagerError('Dataset %s is already installed.' % self.name)
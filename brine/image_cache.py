@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+
+
+class ImageCache(object):
+    """A thread-safe LRU cache for decoded images with a memory budget.
+
+    When adding an image would go over `max_bytes`, the least recently used images are evicted until it fits.
+    Images larger than the whole budget are not cached.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        Parameters
+        ----------
+        max_bytes : int
+            The maximum total size, in bytes, of the decoded images kept in the cache.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'ImageCache(max_bytes=%d, size=%d, items=%d)' % (self.max_bytes, self.size, len(self))
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """Returns the image stored for key, or None if it isn't cached."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, image):
+        """Adds an image to the cache, evicting the least recently used images if needed."""
+        nbytes = image_nbytes(image)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            while self._items and self.size + nbytes > self.max_bytes:
+                _, (_, evicted_nbytes) = self._items.popitem(last=False)
+                self.size -= evicted_nbytes
+                self.evictions += 1
+            self._items[key] = (image, nbytes)
+            self.size += nbytes
+
+    def clear(self):
+        """Removes all the images from the cache. The counters are kept."""
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def stats(self):
+        """Returns a dict with the hits, misses and evictions counters and the current size of the cache."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'items': len(self._items),
+                'size': self.size,
+                'max_bytes': self.max_bytes,
+            }
+
+
+def image_nbytes(image):
+    """Returns the approximate size in memory of a decoded PIL image or a numpy array."""
+    if hasattr(image, 'nbytes'):
+        return image.nbytes
+    width, height = image.size
+    bands = len(image.getbands())
+    bytes_per_band = 4 if image.mode in ('I', 'F') else 1
+    return width * height * bands * bytes_per_band
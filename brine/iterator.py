@@ -202,39 +202,67 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
-import numpy as np
+class Iterator(object):
+    """Splits the epochs of a sampler into batches of indices.
 
+    The iterator keeps track of the current epoch and of the offset of the next batch in that epoch. Since the
+    sampler generates the order of an epoch from the seed and the epoch number alone, saving that position with
+    :meth:`state_dict` and restoring it with :meth:`load_state_dict` resumes in the middle of an epoch without replaying
+    the batches before it.
 
-class Iterator(object):
+    Parameters
+    ----------
+    sampler : :class:`~brine.sampler.Sampler`
+        The sampler that gives the order of the rows for each epoch.
+    batch_size : int
+        The number of indices in each batch. The last batch of an epoch may be smaller. Defaults to 32.
+    """
 
-    def __init__(self):
-        self.batch_index = 0
+    def __init__(self, sampler, batch_size=32):
+        self.sampler = sampler
+        self.batch_size = batch_size
+        self.epoch = 0
+        self.offset = 0
         self.total_batches_seen = 0
+        self._index_array = None
 
     def reset(self):
-        self.batch_index = 0
+        """Goes back to the start of the current epoch."""
+        self.offset = 0
+
+    def next(self):
+        """Returns the next batch as a tuple (index_array, current_index, current_batch_size)."""
+        if self._index_array is None:
+            self._index_array = self.sampler.epoch_indices(self.epoch)
+        if len(self._index_array) == 0:
+            raise StopIteration
+
+        current_index = self.offset
+        index_array = self._index_array[current_index:current_index + self.batch_size]
+        self.offset += len(index_array)
+        if self.offset >= len(self._index_array):
+            self.epoch += 1
+            self.offset = 0
+            self._index_array = None
+        self.total_batches_seen += 1
+        return index_array, current_index, len(index_array)
 
-    def flow_index(self, n, batch_size=32, shuffle=False, seed=None):
-        # ensure self.batch_index is 0
-        self.reset()
-        while 1:
-            if seed is not None:
-                np.random.seed(seed + self.total_batches_seen)
-            if self.batch_index == 0:
-                index_array = np.arange(n)
-                if shuffle:
-                    index_array = np.random.permutation(n)
+    def state_dict(self):
+        """Returns the position of the iterator as a dict that can be saved with a training checkpoint."""
+        return {
+            'epoch': self.epoch,
+            'offset': self.offset,
+            'total_batches_seen': self.total_batches_seen,
+            'seed': self.sampler.seed,
+        }
 
-            current_index = (self.batch_index * batch_size) % n
-            if n >= current_index + batch_size:
-                current_batch_size = batch_size
-                self.batch_index += 1
-            else:
-                current_batch_size = n - current_index
-                self.batch_index = 0
-            self.total_batches_seen += 1
-            yield (index_array[current_index: current_index + current_batch_size],
-                   current_index, current_batch_size)
+    def load_state_dict(self, state):
+        """Moves the iterator to a position returned by :meth:`state_dict`."""
+        self.sampler.seed = state['seed']
+        self.epoch = state['epoch']
+        self.offset = state['offset']
+        self.total_batches_seen = state['total_batches_seen']
+        self._index_array = None
 
     def __iter__(self):
         # needed if we want to do something like:
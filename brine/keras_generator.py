@@ -1,90 +1,338 @@
 import numpy as np
 import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from keras import backend as K
 from keras.preprocessing.image import img_to_array
+from keras.utils import Sequence
 from brine.iterator import Iterator
+from brine.sampler import Sampler
 
 
-class KerasGenerator(object):
-    """A generator that yields batches of samples. Can be used with Keras' `fit_generator` and `predict_generator`.
-
-    Refer to documentation for :meth:`brine.dataset.Dataset.to_keras`.
+class KerasBatchBuilder(object):
+    """Assembles batches of samples (x, y) from rows of a dataset. Shared by KerasGenerator and KerasSequence.
     """
-    def __init__(self, dataset, x_column, y_column=None, batch_size=32,
-                 shuffle=True, seed=None, processing_function=None):
+    def __init__(self, dataset, x_column, y_column=None, batch_size=32, processing_function=None,
+                 image_workers=None, ring_buffers=0, target_size=None, image_mode=None):
         self.dataset = dataset
         self.x_column = getattr(dataset.columns, x_column)
         if y_column is not None:
             self.y_column = getattr(dataset.columns, y_column)
         else:
             self.y_column = None
+        self._batch_columns = [column.name for column in (self.x_column, self.y_column) if column is not None]
         self.batch_size = batch_size
-        self.shuffle = shuffle
         self.processing_function = processing_function
-        self.lock = threading.Lock()
-        self.index_generator = Iterator().flow_index(len(self.dataset),
-                                                     batch_size=batch_size, shuffle=shuffle, seed=seed)
-
-    def __iter__(self):
-        return self
-
-    def next(self):
-        with self.lock:
-            index_array, current_index, current_batch_size = next(self.index_generator)
-        xs = []
-        ys = []
-        for i, index in enumerate(index_array):
-            row = self.dataset[index]
-            x = getattr(row, self.x_column.name)
-            x = self._preprocess_field(self.x_column, x)
-
-            if self.y_column is not None:
-                y = getattr(row, self.y_column.name)
-                y = self._preprocess_field(self.y_column, y)
-            else:
-                y = None
-
-            if self.processing_function is not None:
-                data = self.processing_function((x, y))
-
-            x = data[0]
-            xs.append(x)
-            if self.y_column is not None:
-                y = data[1]
-                ys.append(y)
-
-        if self.y_column is not None:
-            return np.stack(xs), np.stack(ys)
+        self.image_workers = image_workers
+        # Keras sizes are (height, width), PIL sizes are (width, height)
+        self.target_size = (target_size[1], target_size[0]) if target_size is not None else None
+        self.image_mode = image_mode
+        if self.x_column.isimage() and processing_function is None:
+            self._x_buffer = BatchBuffer(batch_size, ring_size=ring_buffers, dtype=K.floatx())
         else:
-            return np.stack(xs)
+            self._x_buffer = BatchBuffer(batch_size, ring_size=ring_buffers)
+        self._y_buffer = BatchBuffer(batch_size, ring_size=ring_buffers)
 
     def steps_per_epoch(self):
         """The number of batches in one full epoch.
 
-        Equal to the number of rows in the dataset divided by the batch size.
+        Equal to the number of rows in one epoch of the sampler (by default, the number of rows in the dataset)
+        divided by the batch size.
 
         Returns
         -------
         int
         """
-        dataset_len = len(self.dataset)
+        dataset_len = len(self.sampler)
         if dataset_len % self.batch_size == 0:
             return int(dataset_len/self.batch_size)
         else:
             return (int(dataset_len/self.batch_size) + 1)
 
+    def _get_batch(self, index_array):
+        batch = self.dataset.get_batch(index_array, columns=self._batch_columns, decode_categories=False)
+        x_values = self._load_field_values(self.x_column, batch, index_array)
+        if self.y_column is not None:
+            y_values = self._load_field_values(self.y_column, batch, index_array)
+        else:
+            y_values = [None] * len(x_values)
+
+        if self.processing_function is None:
+            xs = self._x_buffer.stack(x_values)
+            ys = self._y_buffer.stack(y_values)
+        else:
+            x_writer = self._x_buffer.writer(len(index_array))
+            y_writer = self._y_buffer.writer(len(index_array))
+            for x, y in zip(x_values, y_values):
+                x, y = self.processing_function((x, y))
+                x_writer.append(x)
+                if self.y_column is not None:
+                    y_writer.append(y)
+            xs = x_writer.result()
+            ys = y_writer.result()
+
+        if self.y_column is not None:
+            return xs, ys
+        else:
+            return xs
+
+    def _load_field_values(self, column, batch, index_array):
+        if column.isimage():
+            if self.dataset._arrays_match(column.name, self.target_size, self.image_mode):
+                arrays = self.dataset.load_arrays(column.name, index_array).astype(K.floatx())
+                if K.image_data_format() == 'channels_first':
+                    arrays = arrays.transpose(0, 3, 1, 2)
+                return arrays if self.processing_function is None else list(arrays)
+            images = self.dataset.load_images(batch[column.name].tolist(), workers=self.image_workers,
+                                              target_size=self.target_size, mode=self.image_mode)
+            if self.processing_function is None:
+                # Converted to floats when copied into the batch array
+                return [image_to_uint8_array(image) for image in images]
+            return [img_to_array(image) for image in images]
+        if self.processing_function is None:
+            return batch[column.name]
+        return batch[column.name].tolist()
+
+
+class KerasGenerator(KerasBatchBuilder):
+    """A generator that yields batches of samples. Can be used with Keras' `fit_generator` and `predict_generator`.
+
+    Refer to documentation for :meth:`brine.dataset.Dataset.to_keras`.
+
+    When prefetch is set, batches are assembled by background threads. Call :meth:`close` (or use the generator as a
+    context manager) to stop them.
+    """
+    def __init__(self, dataset, x_column, y_column=None, batch_size=32,
+                 shuffle=True, seed=None, processing_function=None, image_workers=None, block_size=None,
+                 buffer_blocks=4, prefetch=0, workers=1, ring_buffers=0, sampler=None, target_size=None,
+                 image_mode=None):
+        super().__init__(dataset, x_column, y_column, batch_size=batch_size, processing_function=processing_function,
+                         image_workers=image_workers, ring_buffers=ring_buffers, target_size=target_size,
+                         image_mode=image_mode)
+        if sampler is None:
+            sampler = Sampler(len(dataset), shuffle=shuffle, seed=seed, block_size=block_size,
+                              buffer_blocks=buffer_blocks)
+        self.sampler = sampler
+        self.shuffle = shuffle
+        self.prefetch = prefetch
+        self.workers = workers
+        self.waits = 0
+        self._executor = None
+        self._pending = deque()
+        self._closed = False
+        self.lock = threading.Lock()
+        self.iterator = Iterator(sampler, batch_size=batch_size)
+
+    def __iter__(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, tb):
+        self.close()
+
+    def next(self):
+        if not self.prefetch:
+            with self.lock:
+                index_array, current_index, current_batch_size = self.iterator.next()
+            return self._get_batch(index_array)
+
+        with self.lock:
+            if self._closed:
+                raise StopIteration
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            self._fill_queue(self.prefetch + 1)
+            _, future = self._pending.popleft()
+            self._fill_queue(self.prefetch)
+            if not future.done():
+                self.waits += 1
+        # Exceptions raised while assembling the batch are raised here, in the caller's thread
+        return future.result()
+
+    def state_dict(self):
+        """Returns the position of the generator, to be saved with a training checkpoint.
+
+        Prefetched batches that haven't been returned yet are not counted, so they are generated again after resuming.
+
+        Returns
+        -------
+        dict
+            The epoch, the offset in the epoch and the seed of the generator.
+        """
+        with self.lock:
+            if self._pending:
+                return dict(self._pending[0][0])
+            return self.iterator.state_dict()
+
+    def load_state_dict(self, state):
+        """Moves the generator to a position returned by :meth:`state_dict`. The next batch is the one that
+        followed the last batch returned when the state was saved.
+        """
+        with self.lock:
+            self._cancel_pending()
+            self.iterator.load_state_dict(state)
+
+    def close(self):
+        """Stops the background threads and drops the prefetched batches."""
+        with self.lock:
+            self._closed = True
+            self._cancel_pending()
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    @property
+    def queue_depth(self):
+        """The number of prefetched batches that are ready to be returned.
+
+        If this stays at 0 while training, the model is waiting on batch assembly and training is input-bound. The
+        `waits` attribute counts the batches that weren't ready when they were requested.
+        """
+        return sum(1 for _, future in list(self._pending) if future.done())
+
+    def _fill_queue(self, size):
+        while len(self._pending) < size:
+            state = self.iterator.state_dict()
+            index_array, current_index, current_batch_size = self.iterator.next()
+            self._pending.append((state, self._executor.submit(self._get_batch, index_array)))
+
+    def _cancel_pending(self):
+        for _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+
     def __next__(self, *args, **kwargs):
         return self.next(*args, **kwargs)
 
-    def _preprocess_field(self, column, value):
-        if column.isimage():
-            value = img_to_array(self.dataset.load_image(value))
-        elif column.categories is not None:
-            value = self._get_category_index(column, value)
-        return value
-
-    def _get_category_index(self, column, value):
-        # TODO(rohan): Use a dict for this
-        if isinstance(value, tuple):
-            return tuple(map(lambda v: column.categories.index(v), value))
-        else:
-            return column.categories.index(value)
+
+class KerasSequence(KerasBatchBuilder, Sequence):
+    """A `keras.utils.Sequence` of batches of samples. Can be used with Keras' `fit_generator` and `predict_generator`,
+    including with `use_multiprocessing=True`.
+
+    Batches are indexed, so Keras can assemble them in several processes and still get them in a deterministic order.
+    The rows are shuffled again at the end of each epoch.
+
+    Refer to documentation for :meth:`brine.dataset.Dataset.to_keras_sequence`.
+    """
+    def __init__(self, dataset, x_column, y_column=None, batch_size=32,
+                 shuffle=True, seed=None, processing_function=None, image_workers=None, block_size=None,
+                 buffer_blocks=4, sampler=None, target_size=None, image_mode=None):
+        super().__init__(dataset, x_column, y_column, batch_size=batch_size, processing_function=processing_function,
+                         image_workers=image_workers, target_size=target_size, image_mode=image_mode)
+        if sampler is None:
+            sampler = Sampler(len(dataset), shuffle=shuffle, seed=seed, block_size=block_size,
+                              buffer_blocks=buffer_blocks)
+        self.sampler = sampler
+        self.epoch = 0
+        self.index_array = self.sampler.epoch_indices(self.epoch)
+
+    def __len__(self):
+        return self.steps_per_epoch()
+
+    def __getitem__(self, batch_index):
+        if batch_index < 0 or batch_index >= len(self):
+            raise IndexError
+        return self._get_batch(self.index_array[batch_index * self.batch_size:(batch_index + 1) * self.batch_size])
+
+    def on_epoch_end(self):
+        self.epoch += 1
+        self.index_array = self.sampler.epoch_indices(self.epoch)
+
+
+class BatchBuffer(object):
+    """Copies the samples of a batch into a preallocated batch array instead of stacking a list of samples.
+
+    The shape and dtype of the samples are taken from the first sample seen, unless dtype is given. If ring_size is set,
+    ring_size batch arrays are allocated once and reused in turn, so the returned batches are overwritten ring_size
+    batches later. Otherwise a new batch array is allocated for each batch. Batches with samples of a different shape
+    fall back to np.stack.
+    """
+
+    def __init__(self, batch_size, ring_size=0, dtype=None):
+        self.batch_size = batch_size
+        self.ring_size = ring_size
+        self.dtype = dtype
+        self.sample_shape = None
+        self._ring = []
+        self._ring_index = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Batch arrays and locks are not sent to other processes, eg. Keras multiprocessing workers
+        state = self.__dict__.copy()
+        state['_ring'] = []
+        state['_ring_index'] = 0
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def stack(self, samples):
+        """Returns the samples as a batch array. Numpy arrays that are already batches are returned as is."""
+        if isinstance(samples, np.ndarray) and samples.dtype != object:
+            return samples
+        writer = self.writer(len(samples))
+        for sample in samples:
+            writer.append(sample)
+        return writer.result()
+
+    def writer(self, size):
+        return BatchWriter(self, size)
+
+    def allocate(self, size, sample):
+        with self._lock:
+            if self.sample_shape is None:
+                self.sample_shape = sample.shape
+                self.dtype = self.dtype or sample.dtype
+            if sample.shape != self.sample_shape or size > self.batch_size:
+                return np.empty((size,) + sample.shape, dtype=self.dtype)
+            if not self.ring_size:
+                return np.empty((size,) + self.sample_shape, dtype=self.dtype)
+            if len(self._ring) < self.ring_size:
+                self._ring.append(np.empty((self.batch_size,) + self.sample_shape, dtype=self.dtype))
+            array = self._ring[self._ring_index % len(self._ring)]
+            self._ring_index = (self._ring_index + 1) % self.ring_size
+            return array[:size]
+
+
+class BatchWriter(object):
+
+    def __init__(self, buffer, size):
+        self.buffer = buffer
+        self.size = size
+        self.array = None
+        self.count = 0
+        self.samples = None
+
+    def append(self, sample):
+        sample = np.asarray(sample)
+        if self.samples is not None:
+            self.samples.append(sample)
+            return
+        if self.array is None:
+            self.array = self.buffer.allocate(self.size, sample)
+        if sample.shape != self.array.shape[1:]:
+            self.samples = list(self.array[:self.count]) + [sample]
+            return
+        self.array[self.count] = sample
+        self.count += 1
+
+    def result(self):
+        if self.samples is not None:
+            return np.stack(self.samples)
+        if self.array is None:
+            return np.empty((0,))
+        return self.array
+
+
+def image_to_uint8_array(image):
+    array = np.asarray(image, dtype=np.uint8)
+    if array.ndim == 2:
+        array = array[:, :, np.newaxis]
+    if K.image_data_format() == 'channels_first':
+        array = array.transpose(2, 0, 1)
+    return array
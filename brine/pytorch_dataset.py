@@ -1,16 +1,29 @@
-from torch.utils.data import Dataset
+from collections.abc import Sequence
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
+from torch.utils.data.dataloader import default_collate
+
+from brine.dataset import DEFAULT_IMAGE_WORKERS, get_thread_pool
+from brine.sampler import epoch_generator, random_seed
+from brine.exceptions import BrineError
 
 
 class ImagePathToImage(object):
     """Transform that converts an Image Path into a PIL image.
     """
-    def __init__(self, dataset, filepaths):
+    def __init__(self, dataset, filepaths, workers=None, target_size=None, mode=None):
         self.dataset = dataset
-        self.filepaths = filepaths
+        self.filepaths = list(filepaths)
+        self.workers = workers
+        self.target_size = target_size
+        self.mode = mode
 
     def __call__(self, row):
-        images = {filepath: self.dataset.load_image(getattr(row, filepath)) for filepath in self.filepaths}
-        return row._replace(**images)
+        images = self.dataset.load_images([getattr(row, filepath) for filepath in self.filepaths],
+                                          workers=self.workers, target_size=self.target_size, mode=self.mode)
+        return row._replace(**dict(zip(self.filepaths, images)))
 
 
 class PytorchDataset(Dataset):
@@ -19,38 +32,270 @@ class PytorchDataset(Dataset):
 
     See documentation for :meth:`~brine.dataset.Dataset.to_pytorch`
     """
-    def __init__(self, dataset, transform=None, transform_columns=None):
+    def __init__(self, dataset, transform=None, transform_columns=None, image_workers=None, target_size=None,
+                 image_mode=None):
         self.dataset = dataset
-        self.image_columns = {column.name for column in self.dataset.columns if column.isimage()}
-        self.category_columns = {column for column in self.dataset.columns if column.categories is not None}
+        self.image_columns = [column.name for column in self.dataset.columns if column.isimage()]
+        self.image_workers = image_workers
+        self.target_size = target_size
+        self.image_mode = image_mode
         if (transform_columns is not None) and (transform is None):
             raise "transform must be set if transform_columns is set"
         if transform is not None:
             self.transform = transform
             self.transform_columns = transform_columns
         else:
-            self.transform = ImagePathToImage(dataset, self.image_columns)
+            self.transform = ImagePathToImage(dataset, self.image_columns, workers=image_workers,
+                                              target_size=target_size, mode=image_mode)
             self.transform_columns = None
 
     def __len__(self):
         return len(self.dataset)
 
     def __getitem__(self, index):
-        row = self.dataset[index]
-        category_indexed = {column.name: self._get_category_index(column, getattr(row, column.name))
-                            for column in self.category_columns}
-        row = row._replace(**category_indexed)
+        return self._transform_row(self.dataset.get_rows([index], decode_categories=False)[0])
+
+    def __getitems__(self, indices):
+        """Returns the rows for a batch of indices, reading them from the dataset all at once.
+
+        Called by PyTorch DataLoaders in place of __getitem__ for each index. The rows are returned as a
+        :class:`RowBatch`, which builds and transforms each row when it's accessed, so it can be passed to the default
+        collate function, or to :class:`FastCollate` which skips building rows entirely.
+        """
+        return RowBatch(self, indices, self.dataset.get_batch(indices, decode_categories=False))
+
+    def fast_collate(self, pin_memory=False, channels_first=True):
+        """Returns a :class:`FastCollate` collate function for this dataset. See :class:`FastCollate`."""
+        return FastCollate(pin_memory=pin_memory, channels_first=channels_first, image_workers=self.image_workers,
+                           target_size=self.target_size, image_mode=self.image_mode)
+
+    def _transform_row(self, row):
         if self.transform_columns == 'images':
-            for column_name in self.image_columns:
-                image = self.dataset.load_image(getattr(row, column_name))
-                row = row._replace(**{column_name: self.transform(image)})
+            images = self.dataset.load_images([getattr(row, column_name) for column_name in self.image_columns],
+                                              workers=self.image_workers, target_size=self.target_size,
+                                              mode=self.image_mode)
+            row = row._replace(**{column_name: self.transform(image)
+                                  for column_name, image in zip(self.image_columns, images)})
         else:
             row = self.transform(row)
         return row
 
-    def _get_category_index(self, column, value):
-        # TODO(rohan): Use a dict for this
-        if isinstance(value, tuple):
-            return tuple(map(lambda v: column.categories.index(v), value))
+
+class PytorchIterableDataset(IterableDataset):
+    """A PyTorch IterableDataset that streams the rows of the Brine Dataset in the order they are stored.
+
+    The rows are split in chunks of consecutive rows, and the chunks are laid end to end. Each DataLoader worker of
+    each rank reads its own run of ceil(len(dataset) / (world_size * num_workers)) rows of them, so every chunk is
+    decompressed about once and images are read in the order they were written. As with PyTorch's
+    DistributedSampler, the last runs wrap around to the first rows, so that all the workers and ranks get the same
+    number of rows and distributed jobs run the same number of steps on every rank.
+
+    Rows are shuffled by taking the chunks in a random order and by drawing rows at random from a buffer of
+    shuffle_buffer rows. The chunk order depends only on the seed and the epoch, so all the workers and ranks read
+    disjoint rows as long as they use the same seed. Call :meth:`set_epoch` before each epoch to change the order.
+
+    See documentation for :meth:`~brine.dataset.Dataset.to_pytorch_iterable`
+    """
+    def __init__(self, dataset, shuffle_buffer=0, seed=None, rank=0, world_size=1, chunk_size=None, transform=None,
+                 transform_columns=None, image_workers=None, target_size=None, image_mode=None):
+        self.rows = PytorchDataset(dataset, transform=transform, transform_columns=transform_columns,
+                                   image_workers=image_workers, target_size=target_size, image_mode=image_mode)
+        self.dataset = dataset
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed if seed is not None else random_seed()
+        self.rank = rank
+        self.world_size = world_size
+        self.chunk_size = chunk_size or dataset.chunklen
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        num_workers, worker_id = (1, 0) if worker_info is None else (worker_info.num_workers, worker_info.id)
+        num_shards = self.world_size * num_workers
+        shard = self.rank * num_workers + worker_id
+
+        chunk_starts = np.arange(0, len(self.dataset), self.chunk_size)
+        if self.shuffle_buffer:
+            chunk_starts = epoch_generator(self.seed, self.epoch).permutation(chunk_starts)
+        rows_per_shard = -(-len(self.dataset) // num_shards)
+        rows = self._iter_range_rows(self._shard_ranges(chunk_starts, shard * rows_per_shard, rows_per_shard))
+        if self.shuffle_buffer:
+            rows = self._shuffle(rows, np.random.default_rng([self.seed, self.epoch, shard]))
+        # Images are only loaded when rows leave the shuffle buffer
+        for row in rows:
+            yield self.rows._transform_row(row)
+
+    def _shard_ranges(self, chunk_starts, position, num_rows):
+        # Returns the (start, stop) row ranges of num_rows rows from position in the chunks laid end to end, wrapping
+        # around to the first chunk at the end
+        lengths = np.minimum(chunk_starts + self.chunk_size, len(self.dataset)) - chunk_starts
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        ranges = []
+        while num_rows > 0:
+            position %= len(self.dataset)
+            chunk = np.searchsorted(offsets, position, side='right') - 1
+            start = chunk_starts[chunk] + position - offsets[chunk]
+            size = min(num_rows, offsets[chunk + 1] - position)
+            ranges.append((int(start), int(start + size)))
+            position += size
+            num_rows -= size
+        return ranges
+
+    def _iter_range_rows(self, ranges):
+        for start, stop in ranges:
+            batch = self.dataset.get_batch(np.arange(start, stop), decode_categories=False)
+            for row in self.dataset._batch_rows(batch):
+                yield row
+
+    def _shuffle(self, rows, random_state):
+        buffer = []
+        for row in rows:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(row)
+                continue
+            index = random_state.integers(len(buffer))
+            yield buffer[index]
+            buffer[index] = row
+        for index in random_state.permutation(len(buffer)):
+            yield buffer[index]
+
+
+class RowBatch(Sequence):
+    """The rows of a batch read with :meth:`PytorchDataset.__getitems__`.
+
+    Holds the batch as columns. Indexing it returns the same transformed row as :meth:`PytorchDataset.__getitem__`.
+    Transformed rows are kept, since the default collate function reads the first row twice.
+    """
+    def __init__(self, pytorch_dataset, indices, columns):
+        self.pytorch_dataset = pytorch_dataset
+        self.indices = indices
+        self.columns = columns
+        self._rows = {}
+        self._values = None
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index not in self._rows:
+            if self._values is None:
+                # Python values, as in the rows returned by __getitem__
+                self._values = [values.tolist() for values in self.columns.values()]
+            row = self.pytorch_dataset.dataset.Row(*(values[index] for values in self._values))
+            self._rows[index] = self.pytorch_dataset._transform_row(row)
+        return self._rows[index]
+
+
+class FastCollate(object):
+    """A collate function for PytorchDataset batches that doesn't build a namedtuple per row.
+
+    Pass it as the `collate_fn` of a DataLoader. Each batch is returned as a dict of column name to:
+
+    * a uint8 tensor of shape (batch size, channels, height, width) for Image columns, or (batch size, height, width,
+      channels) if channels_first is False. Images are decoded directly into the batch tensor, or copied from the
+      decoded array file if the dataset was built with decoded images. All the images must have the same size.
+    * an int64 tensor of category codes for Category columns.
+    * a tensor for Integer and Float columns.
+    * a list for String and array columns.
+
+    The transform of the PytorchDataset is not applied: normalize and augment the uint8 batches afterwards, eg. on the
+    GPU. Batches that don't come from :meth:`PytorchDataset.__getitems__` (older PyTorch versions only call
+    __getitem__) fall back to the default collate function.
+
+    Parameters
+    ----------
+    pin_memory : bool
+        Whether to allocate the image tensors in pinned memory, for faster copies to the GPU. Only applies when the
+        batch is collated in the main process (num_workers=0): in DataLoader workers, pinning would initialize CUDA
+        in a forked process, and batches are moved to shared memory anyway. With workers, pass pin_memory=True to
+        the DataLoader instead. Defaults to False.
+    channels_first : bool
+        Whether image tensors have the channels before the height and width, as torchvision expects.
+        Defaults to True.
+    image_workers : int
+        The number of threads used to decode the images of a batch. See :meth:`~brine.dataset.Dataset.load_images`.
+        Defaults to None.
+    target_size : tuple of int
+        The (width, height) to resize images to, so that images of different sizes can be batched.
+        See :meth:`~brine.dataset.Dataset.load_image`. Defaults to None.
+    image_mode : str
+        The PIL mode to convert images to. Defaults to None.
+    """
+    def __init__(self, pin_memory=False, channels_first=True, image_workers=None, target_size=None, image_mode=None):
+        self.pin_memory = pin_memory
+        self.channels_first = channels_first
+        self.image_workers = image_workers
+        self.target_size = target_size
+        self.image_mode = image_mode
+
+    def __call__(self, batch):
+        if not isinstance(batch, RowBatch):
+            return default_collate(batch)
+        dataset = batch.pytorch_dataset.dataset
+        result = {}
+        for column in dataset.columns:
+            values = batch.columns[column.name]
+            if column.isimage():
+                result[column.name] = self._collate_images(dataset, column.name, batch.indices, values)
+            elif values.dtype.kind in 'biuf':
+                result[column.name] = torch.from_numpy(np.ascontiguousarray(values))
+            else:
+                result[column.name] = values.tolist()
+        return result
+
+    def _collate_images(self, dataset, column_name, indices, image_paths):
+        if dataset._arrays_match(column_name, self.target_size, self.image_mode):
+            arrays = dataset.load_arrays(column_name, indices)
+            images = self._allocate(len(arrays), arrays.shape[1:])
+            images.numpy()[...] = arrays.transpose(0, 3, 1, 2) if self.channels_first else arrays
+            return images
+        if len(image_paths) == 0:
+            return torch.empty((0,), dtype=torch.uint8)
+        first = self._decode(dataset, image_paths[0])
+        images = self._allocate(len(image_paths), first.shape)
+        # The tensor shares its memory with this array, so images are written once
+        arrays = images.numpy()
+        self._write(arrays, 0, first, image_paths[0])
+        workers = DEFAULT_IMAGE_WORKERS if self.image_workers is None else self.image_workers
+
+        def write(index):
+            self._write(arrays, index, self._decode(dataset, image_paths[index]), image_paths[index])
+
+        if workers <= 1 or len(image_paths) <= 2:
+            for index in range(1, len(image_paths)):
+                write(index)
         else:
-            return column.categories.index(value)
+            list(get_thread_pool(workers).map(write, range(1, len(image_paths))))
+        return images
+
+    def _allocate(self, size, image_shape):
+        height, width, channels = image_shape
+        shape = (size, channels, height, width) if self.channels_first else (size, height, width, channels)
+        pin_memory = self.pin_memory and get_worker_info() is None
+        return torch.empty(shape, dtype=torch.uint8, pin_memory=pin_memory)
+
+    def _decode(self, dataset, image_path):
+        array = np.asarray(dataset._load_decoded_image(image_path, target_size=self.target_size, mode=self.image_mode),
+                           dtype=np.uint8)
+        if array.ndim == 2:
+            array = array[:, :, np.newaxis]
+        return array
+
+    def _write(self, arrays, index, array, image_path):
+        if self.channels_first:
+            array = array.transpose(2, 0, 1)
+        if array.shape != arrays.shape[1:]:
+            raise PytorchDatasetError('Image %s has shape %s but the batch has shape %s. Resize the images to the same '
+                                      'size.' % (image_path, array.shape, arrays.shape[1:]))
+        arrays[index] = array
+
+
+class PytorchDatasetError(BrineError):
+    pass
@@ -0,0 +1,171 @@
+import ast
+
+from brine.exceptions import BrineError
+
+
+# Functions that numexpr can evaluate
+QUERY_FUNCTIONS = frozenset([
+    'abs', 'sqrt', 'exp', 'expm1', 'log', 'log1p', 'log10', 'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan',
+    'arctan2', 'sinh', 'cosh', 'tanh', 'arcsinh', 'arccosh', 'arctanh', 'where', 'contains',
+])
+
+_BOOL_OPERATORS = {ast.And: '&', ast.Or: '|'}
+_BINARY_OPERATORS = {
+    ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.Mod: '%', ast.Pow: '**',
+    ast.BitAnd: '&', ast.BitOr: '|', ast.BitXor: '^',
+}
+_UNARY_OPERATORS = {ast.Not: '~', ast.Invert: '~', ast.USub: '-', ast.UAdd: '+'}
+_COMPARE_OPERATORS = {ast.Eq: '==', ast.NotEq: '!=', ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>='}
+
+
+def translate_query(expression, columns):
+    """Translates a Python-like query over the columns of a dataset to a numexpr expression.
+
+    `and`, `or` and `not` are translated to numexpr's `&`, `|` and `~`, chained comparisons are split, and the
+    values of category columns are translated to their integer codes. Category columns can also be tested with
+    `in` and `not in` against a list of values.
+
+    Parameters
+    ----------
+    expression : str
+        The query, eg. "label in ['cat', 'dog'] and 0.5 < score <= 0.8".
+    columns : list of :class:`~brine.schema.Column`
+        The columns that can be used in the query.
+
+    Returns
+    -------
+    str
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError:
+        raise QueryError('Could not parse query %s.' % expression)
+    return QueryTranslator({column.name: column for column in columns}).visit(tree.body)
+
+
+def equality_query(values):
+    """Returns a query that matches rows where each column is equal to a value, or to one of a list of values."""
+    terms = []
+    for name, value in sorted(values.items()):
+        if isinstance(value, (list, tuple, set, frozenset)):
+            terms.append('%s in %r' % (name, list(value)))
+        else:
+            terms.append('%s == %r' % (name, value))
+    return ' and '.join(terms)
+
+
+class QueryTranslator(ast.NodeVisitor):
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def generic_visit(self, node):
+        raise QueryError('Unsupported expression in query: %s.' % type(node).__name__)
+
+    def visit_BoolOp(self, node):
+        operator = ' %s ' % _BOOL_OPERATORS[type(node.op)]
+        return '(%s)' % operator.join(self.visit(value) for value in node.values)
+
+    def visit_UnaryOp(self, node):
+        operator = _UNARY_OPERATORS.get(type(node.op))
+        if operator is None:
+            return self.generic_visit(node)
+        return '(%s%s)' % (operator, self.visit(node.operand))
+
+    def visit_BinOp(self, node):
+        operator = _BINARY_OPERATORS.get(type(node.op))
+        if operator is None:
+            return self.generic_visit(node)
+        return '(%s %s %s)' % (self.visit(node.left), operator, self.visit(node.right))
+
+    def visit_Compare(self, node):
+        terms = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            if isinstance(op, (ast.In, ast.NotIn)):
+                terms.append(self._membership(left, right, negate=isinstance(op, ast.NotIn)))
+            elif type(op) in _COMPARE_OPERATORS:
+                terms.append('(%s %s %s)' % (self._operand(left, right), _COMPARE_OPERATORS[type(op)],
+                                             self._operand(right, left)))
+            else:
+                return self.generic_visit(node)
+            left = right
+        return terms[0] if len(terms) == 1 else '(%s)' % ' & '.join(terms)
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in QUERY_FUNCTIONS or node.keywords:
+            raise QueryError('Unsupported function in query: %s.' % getattr(node.func, 'id', type(node.func).__name__))
+        return '%s(%s)' % (node.func.id, ', '.join(self.visit(arg) for arg in node.args))
+
+    def visit_Name(self, node):
+        if node.id in ('True', 'False'):
+            return node.id
+        self._column(node)
+        return node.id
+
+    def visit_Constant(self, node):
+        return repr(node.value)
+
+    # Python < 3.8
+    visit_Num = visit_Str = visit_Bytes = visit_NameConstant = visit_Constant
+
+    def _column(self, node):
+        column = self.columns.get(node.id)
+        if column is None:
+            raise QueryError('Unknown column in query: %s.' % node.id)
+        if column.isarray():
+            raise QueryError('Array column %s can\'t be used in a query.' % node.id)
+        return column
+
+    def _category_column(self, node):
+        if not isinstance(node, ast.Name) or node.id in ('True', 'False'):
+            return None
+        column = self._column(node)
+        return column if column.categories is not None else None
+
+    def _operand(self, node, other):
+        # Category values compared with a category column are replaced with their codes
+        column = self._category_column(other)
+        if column is not None and _is_string(node):
+            return str(_category_code(column, _constant_value(node)))
+        return self.visit(node)
+
+    def _membership(self, left, right, negate):
+        if not isinstance(right, (ast.List, ast.Tuple, ast.Set)):
+            raise QueryError('The right side of `in` must be a list of values.')
+        name = self.visit(left)
+        column = self._category_column(left)
+        values = []
+        for element in right.elts:
+            if column is not None and _is_string(element):
+                values.append(str(_category_code(column, _constant_value(element))))
+            else:
+                values.append(self.visit(element))
+        if not values:
+            # numexpr has no boolean literals for a whole column
+            return '(%s %s %s)' % (name, '==' if negate else '!=', name)
+        operator, joiner = ('!=', ' & ') if negate else ('==', ' | ')
+        return '(%s)' % joiner.join('(%s %s %s)' % (name, operator, value) for value in values)
+
+
+class QueryError(BrineError):
+    pass
+
+
+def _is_string(node):
+    return isinstance(_constant_value(node, default=None), str)
+
+
+def _constant_value(node, default=None):
+    if hasattr(ast, 'Constant') and isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, getattr(ast, 'Str', ())):
+        return node.s
+    return default
+
+
+def _category_code(column, value):
+    try:
+        return column.column_type.category_indices[value]
+    except KeyError:
+        raise QueryError('Column %s has no category %s.' % (column.name, value))
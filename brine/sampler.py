@@ -0,0 +1,243 @@
+import numpy as np
+
+from brine.exceptions import BrineError
+
+
+class Sampler(object):
+    """Yields the indices of the rows of a dataset in the order of one epoch.
+
+    Can be passed as the `sampler` of a PyTorch DataLoader. Each iteration over the sampler is a new epoch.
+
+    Parameters
+    ----------
+    n : int
+        The number of rows in the dataset.
+    shuffle : bool
+        Whether to return the rows in random order. Defaults to True.
+    seed : int
+        Seed to use for the random number generator. The order of each epoch only depends on the seed and the epoch
+        number. If None, a random seed is drawn.
+    block_size : int
+        If set, rows are shuffled by blocks of block_size consecutive rows instead of individually.
+        See :func:`~brine.sampler.block_permutation`. Defaults to None.
+    buffer_blocks : int
+        How many blocks rows can be mixed across when block_size is set. Defaults to 4.
+    """
+
+    def __init__(self, n, shuffle=True, seed=None, block_size=None, buffer_blocks=4):
+        self.n = n
+        self.shuffle = shuffle
+        self.seed = seed if seed is not None else random_seed()
+        self.block_size = block_size
+        self.buffer_blocks = buffer_blocks
+        self.epoch = 0
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        indices = self.epoch_indices(self.epoch)
+        self.epoch += 1
+        # Python ints are made one at a time, without building a list of the whole epoch
+        return map(int, indices)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def epoch_indices(self, epoch):
+        """Returns the indices of the rows for the given epoch as a numpy array."""
+        if not self.shuffle:
+            return np.arange(self.n)
+        return shuffled_indices(self.n, epoch_generator(self.seed, epoch), self.block_size, self.buffer_blocks)
+
+
+class DistributedSampler(Sampler):
+    """Yields the indices of the rows that one rank of a distributed training job should read in one epoch.
+
+    Every rank gets ceil(n / world_size) rows, and rows from the start of the epoch are repeated to pad the last
+    ranks. As long as every rank uses the same seed, the ranks get disjoint rows (apart from padding) and the rows are
+    reshuffled across ranks every epoch.
+
+    Parameters
+    ----------
+    n : int
+        The number of rows in the dataset.
+    rank : int
+        The rank of this process, between 0 and world_size - 1.
+    world_size : int
+        The number of processes taking part in training.
+    shuffle : bool
+        Whether to return the rows in random order. Defaults to True.
+    seed : int
+        Seed to use for the random number generator. Must be the same on all ranks. Defaults to 0.
+    block_size : int
+        If set, rows are shuffled by blocks of block_size consecutive rows. See :class:`~brine.sampler.Sampler`.
+    buffer_blocks : int
+        How many blocks rows can be mixed across when block_size is set. Defaults to 4.
+    locality : bool
+        If True, each rank always reads the same contiguous part of the dataset and only the order inside that part
+        changes between epochs. Rows stay on the rank that has them cached, at the cost of less random batches.
+        Defaults to False.
+    """
+
+    def __init__(self, n, rank, world_size, shuffle=True, seed=0, block_size=None, buffer_blocks=4, locality=False):
+        if world_size < 1 or not 0 <= rank < world_size:
+            raise SamplerError('Rank %s is not valid for world size %s.' % (rank, world_size))
+        super().__init__(n, shuffle=shuffle, seed=seed, block_size=block_size, buffer_blocks=buffer_blocks)
+        self.rank = rank
+        self.world_size = world_size
+        self.locality = locality
+        self.num_samples = -(-n // world_size)
+
+    def __len__(self):
+        return self.num_samples
+
+    def epoch_indices(self, epoch):
+        if self.n == 0:
+            return np.arange(0)
+        if self.locality:
+            start = self.rank * self.num_samples
+            shard = np.arange(start, start + self.num_samples) % self.n
+            if not self.shuffle:
+                return shard
+            order = shuffled_indices(self.num_samples, epoch_generator(self.seed, epoch), self.block_size,
+                                     self.buffer_blocks)
+            return shard[order]
+        total = self.num_samples * self.world_size
+        indices = np.resize(super().epoch_indices(epoch), total)
+        return indices[self.rank:total:self.world_size]
+
+
+class WeightedSampler(Sampler):
+    """Yields the indices of rows drawn at random with probabilities proportional to per-row weights.
+
+    Rows are drawn with numpy in one vectorized step per epoch: with replacement, by a binary search of uniform draws
+    in the cumulative sum of the weights; without replacement, by keeping the rows with the largest random keys
+    U ** (1 / weight).
+
+    Parameters
+    ----------
+    weights : numpy array
+        The non-negative weight of each row of the dataset.
+    num_samples : int
+        The number of rows in an epoch. Defaults to the number of rows of the dataset.
+    replacement : bool
+        Whether rows can be drawn several times in the same epoch. Defaults to True.
+    seed : int
+        Seed to use for the random number generator. The rows of each epoch only depend on the seed and the epoch
+        number. If None, a random seed is drawn.
+    """
+
+    def __init__(self, weights, num_samples=None, replacement=True, seed=None):
+        weights = np.asarray(weights, dtype=np.float64).reshape(-1)
+        if weights.size and (not np.isfinite(weights).all() or weights.min() < 0):
+            raise SamplerError('Weights must be finite and non-negative.')
+        num_positive = int(np.count_nonzero(weights))
+        if num_positive == 0:
+            raise SamplerError('At least one weight must be positive.')
+        num_samples = len(weights) if num_samples is None else num_samples
+        if not replacement and num_samples > num_positive:
+            raise SamplerError('Cannot draw %d rows without replacement from %d rows with a positive weight.' % (
+                num_samples, num_positive))
+        super().__init__(len(weights), shuffle=True, seed=seed)
+        self.weights = weights
+        self.num_samples = num_samples
+        self.replacement = replacement
+        self._cumulative_weights = np.cumsum(weights)
+
+    def __len__(self):
+        return self.num_samples
+
+    def epoch_indices(self, epoch):
+        random_state = epoch_generator(self.seed, epoch)
+        if self.replacement:
+            total = self._cumulative_weights[-1]
+            draws = random_state.random(self.num_samples) * total
+            indices = np.searchsorted(self._cumulative_weights, draws, side='right')
+            # Guards against rounding in the last cumulative weight
+            return np.minimum(indices, self.n - 1)
+        with np.errstate(divide='ignore'):
+            keys = np.log(random_state.random(self.n)) / self.weights
+        if self.num_samples == 0:
+            return np.arange(0)
+        top = np.argpartition(-keys, self.num_samples - 1)[:self.num_samples]
+        return top[np.argsort(-keys[top], kind='mergesort')]
+
+
+def class_weights(counts, mode='inverse'):
+    """Returns the weight of each class for class-balanced sampling.
+
+    Parameters
+    ----------
+    counts : numpy array
+        The number of rows of each class.
+    mode : str
+        'inverse' to weight classes by 1 / count, so that every class is drawn as often, or 'sqrt' to weight them by
+        1 / sqrt(count), which only partly balances long-tailed classes. Defaults to 'inverse'.
+
+    Returns
+    -------
+    numpy array
+        The weight of each class. Classes without rows get a weight of 0.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    if mode == 'inverse':
+        scale = counts
+    elif mode == 'sqrt':
+        scale = np.sqrt(counts)
+    else:
+        raise SamplerError('Unsupported weighting mode %s.' % mode)
+    weights = np.zeros(len(counts))
+    np.divide(1.0, scale, out=weights, where=counts > 0)
+    return weights
+
+
+class SamplerError(BrineError):
+    pass
+
+
+def random_seed():
+    return int(np.random.SeedSequence().entropy)
+
+
+def epoch_generator(seed, epoch):
+    """Returns a numpy random Generator for an epoch, which doesn't touch the global numpy random state."""
+    return np.random.default_rng([seed, epoch])
+
+
+def shuffled_indices(n, random_state, block_size=None, buffer_blocks=4):
+    if block_size is None:
+        return random_state.permutation(n)
+    return block_permutation(n, block_size, buffer_blocks, random_state)
+
+
+def block_permutation(n, block_size, buffer_blocks=4, random_state=np.random):
+    """Returns a random permutation of range(n) that keeps rows close to the other rows of their block.
+
+    Rows are split in blocks of block_size consecutive rows and the order of the blocks is shuffled. Rows are then
+    shuffled inside a rolling window of buffer_blocks blocks: each row ends up among the rows of its block and of the
+    buffer_blocks - 1 blocks that follow it in the shuffled order. With a block size equal to the chunk length of
+    the dataset, each batch only touches a few compressed chunks and image directories.
+
+    Parameters
+    ----------
+    n : int
+        The number of rows.
+    block_size : int
+        The number of consecutive rows in a block.
+    buffer_blocks : int
+        The number of blocks rows are mixed across. Higher values are closer to a full permutation.
+        If 0, rows keep their order inside each block. Defaults to 4.
+    random_state : numpy.random.Generator
+        The random number generator to use. Defaults to the global numpy generator.
+
+    Returns
+    -------
+    numpy array
+    """
+    num_blocks = -(-n // block_size)
+    block_order = random_state.permutation(num_blocks)
+    block_ranks = np.empty(num_blocks, dtype=np.int64)
+    block_ranks[block_order] = np.arange(num_blocks)
+    keys = block_ranks[np.arange(n) // block_size] + random_state.random(n) * buffer_blocks
+    return np.argsort(keys, kind='mergesort')
@@ -51,6 +51,15 @@ class Column(object):
             return None
         return self.column_type.categories
 
+    def category_index(self, value):
+        """Returns the integer code of a category value in this column."""
+        if self.categories is None:
+            raise SchemaError('Column %s is not a category column.' % self.name)
+        try:
+            return self.column_type.category_indices[value]
+        except KeyError:
+            raise SchemaError('Column %s has no category %s.' % (self.name, value))
+
     def isimage(self):
         return isinstance(self.column_type, Image)
 
@@ -123,6 +132,7 @@ class Category(ColumnType):
 
     def __init__(self, categories):
         self.categories = categories
+        self.category_indices = {category: i for i, category in enumerate(categories or [])}
 
     def __repr__(self):
         return 'Category'
@@ -156,6 +166,7 @@ class CategoryArray(ColumnType):
 
     def __init__(self, categories):
         self.categories = categories
+        self.category_indices = {category: i for i, category in enumerate(categories or [])}
 
     def __repr__(self):
         return 'CategoryArray'
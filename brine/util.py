@@ -5,8 +5,8 @@ import tempfile
 
 class TemporaryDirectory(object):
 
-    def __init__(self):
-        self.name = tempfile.mkdtemp()
+    def __init__(self, dir=None):
+        self.name = tempfile.mkdtemp(dir=dir)
 
     def __repr__(self):
         return "<{} {!r}>".format(self.__class__.__name__, self.name)
@@ -23,7 +23,7 @@ setup(
     install_requires=[
         "requests>=2.14.0",
         "tqdm>=4.17.0",
-        "numpy>=1.7.0",
+        "numpy>=1.17.0",
         "bcolz>=1.1.1",
         "pandas>=0.19.0",
         "pillow",